@@ -0,0 +1,143 @@
+import os
+import json
+import gzip
+import hashlib
+import datetime
+
+import dateutil.parser
+
+class IssueCache(object):
+    """An on-disk cache of the raw JSON (including changelog) of the issues
+    matching a single query on a single JIRA server, with a given list of
+    fields.
+
+    Issues are keyed by issue key. The time of the last successful sync is
+    stored alongside them, so that subsequent runs only need to fetch issues
+    updated since then.
+    """
+
+    timestamp_format = "%Y-%m-%dT%H:%M:%S"
+
+    def __init__(self, directory, server, query, fields=()):
+        self.directory = directory
+        self.server = server
+        self.query = query
+        self.fields = list(fields)
+
+        digest = hashlib.sha1((u"%s\n%s\n%s" % (server, query, ','.join(self.fields),)).encode('utf-8')).hexdigest()
+        self.path = os.path.join(directory, "issues-%s.json.gz" % digest)
+
+        self.last_sync = None  # UTC datetime
+        self.issues = {}
+
+    def load(self):
+        """Load the cache from disk, if it exists. Returns `True` if it did.
+        """
+
+        if not os.path.exists(self.path):
+            return False
+
+        with gzip.open(self.path, 'rb') as f:
+            data = json.loads(f.read().decode('utf-8'))
+
+        self.last_sync = datetime.datetime.strptime(data['last_sync'], self.timestamp_format)
+        self.issues = dict((issue['key'], issue,) for issue in data['issues'])
+
+        return True
+
+    def save(self):
+        """Write the cache to disk, replacing any previous version atomically.
+        """
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        data = {
+            'server': self.server,
+            'query': self.query,
+            'fields': self.fields,
+            'last_sync': self.last_sync.strftime(self.timestamp_format),
+            'issues': self.issues.values(),
+        }
+
+        temp_path = self.path + '.tmp'
+        with gzip.open(temp_path, 'wb') as f:
+            f.write(json.dumps(data).encode('utf-8'))
+        os.rename(temp_path, self.path)
+
+    def clear(self):
+        self.last_sync = None
+        self.issues = {}
+
+    def merge(self, issues):
+        """Add or replace the raw JSON for each issue in `issues`.
+        """
+        for issue in issues:
+            self.issues[issue['key']] = issue
+
+    def retain(self, keys):
+        """Remove any cached issue whose key is not in `keys`. Returns the
+        keys that were removed.
+        """
+        keys = set(keys)
+        removed = [key for key in self.issues if key not in keys]
+        for key in removed:
+            del self.issues[key]
+        return removed
+
+    def ordered(self):
+        """Return the raw JSON of all cached issues, most recently updated
+        first.
+        """
+        return sorted(
+            self.issues.values(),
+            key=lambda issue: (dateutil.parser.parse(issue['fields']['updated']), issue['key'],),
+            reverse=True
+        )
+
+class FieldCache(object):
+    """An on-disk cache of the field metadata returned by `JIRA.fields()`
+    for a single JIRA server, which expires after `ttl` (a timedelta).
+    """
+
+    timestamp_format = IssueCache.timestamp_format
+
+    def __init__(self, directory, server, ttl):
+        self.directory = directory
+        self.server = server
+        self.ttl = ttl
+
+        digest = hashlib.sha1(server.encode('utf-8')).hexdigest()
+        self.path = os.path.join(directory, "fields-%s.json" % digest)
+
+    def load(self):
+        """Return the cached list of fields, or `None` if there is no cache
+        or it has expired.
+        """
+
+        if not os.path.exists(self.path):
+            return None
+
+        with open(self.path, 'rb') as f:
+            data = json.loads(f.read().decode('utf-8'))
+
+        fetched = datetime.datetime.strptime(data['fetched'], self.timestamp_format)
+        if datetime.datetime.utcnow() - fetched > self.ttl:
+            return None
+
+        return data['fields']
+
+    def save(self, fields):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        data = {
+            'server': self.server,
+            'fetched': datetime.datetime.utcnow().strftime(self.timestamp_format),
+            'fields': fields,
+        }
+
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(json.dumps(data).encode('utf-8'))
+        os.rename(temp_path, self.path)
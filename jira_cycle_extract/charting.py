@@ -184,6 +184,31 @@ def throughput_trend_chart(throughput_data, title=None, ax=None):
 
     return ax
 
+def rolling_percentiles_chart(rolling_percentile_data, title=None, ax=None):
+    if len(rolling_percentile_data.index) == 0:
+        raise UnchartableData("Cannot draw rolling percentiles chart with no completed items")
+
+    if ax is None:
+        fig, ax = plt.subplots()
+    else:
+        fig = ax.get_figure()
+
+    if title is not None:
+        ax.set_title(title)
+
+    fig.autofmt_xdate()
+
+    ax.set_xlabel("Completed date")
+    ax.set_ylabel("Cycle time (days)")
+
+    for percentile in rolling_percentile_data.columns:
+        days = rolling_percentile_data[percentile] / np.timedelta64(1, 'D')
+        ax.plot(days.index, days.values, label="%.0f%%" % (percentile * 100,))
+
+    ax.legend(loc=0, title="", frameon=True)
+
+    return ax
+
 def burnup(cfd_data, backlog_column=None, done_column=None, title=None, ax=None):
     if len(cfd_data.index) == 0:
         raise UnchartableData("Cannot draw burnup with no data")
@@ -1,3 +1,5 @@
+import os
+import re
 import argparse
 import getpass
 import json
@@ -12,6 +14,8 @@ from jira import JIRA
 
 from .config import config_to_options
 from .cycletime import CycleTimeQueries
+from .sketch import QuantileSketch
+from .recording import RecordingSession, ReplaySession, ReplayError
 from . import charting
 
 parser = argparse.ArgumentParser(description='Extract cycle time analytics data from JIRA.')
@@ -19,18 +23,34 @@ parser.add_argument('config', metavar='config.yml', help='Configuration file')
 parser.add_argument('output', metavar='data.csv', nargs='?', help='Output file. Contains all issues described by the configuration file, metadata, and dates of entry to each state in the cycle.')
 parser.add_argument('-v', dest='verbose', action='store_true', help='Verbose output')
 parser.add_argument('-n', metavar='N', dest='max_results', type=int, help='Only fetch N most recently updated issues')
+parser.add_argument('--concurrency', metavar='N', type=int, help='Fetch up to N pages of search results from JIRA in parallel. Overrides the `Concurrency` connection option.')
+parser.add_argument('--query-concurrency', metavar='N', type=int, help='Run up to N of the criteria blocks under `Queries` in parallel. Overrides the `Concurrency` option in the `Queries` section.')
+parser.add_argument('--combine-queries', action='store_true', help='Fetch the issues for all the criteria blocks under `Queries` with a single query. Same as setting `Combine` in the `Queries` section.')
+parser.add_argument('--processes', metavar='N', type=int, help='Use N processes to turn the issues fetched from JIRA into cycle data. Useful for large numbers of issues on machines with several cores.')
+parser.add_argument('--compact', action='store_true', help='Use less memory for the cycle data of large numbers of issues. The output is the same.')
+parser.add_argument('--stream', action='store_true', help='Write the cycle data output file a page of issues at a time as they are fetched, so that memory use does not grow with the number of issues. Cannot be used with any other outputs (except --percentiles, which are then approximate) or charts, or with --format=xlsx.')
+parser.add_argument('--cache', metavar='DIR', help='Cache issues fetched from JIRA in this directory, and on subsequent runs only fetch issues that have been updated since. Not used with -n.')
+parser.add_argument('--full-refresh', action='store_true', help='Ignore any issues cached with --cache and fetch everything again.')
+parser.add_argument('--backend', metavar='resources|json', choices=['resources', 'json'], help="How to process issues fetched from JIRA. `json` is faster and uses less memory. Overrides the `Backend` connection option.")
+parser.add_argument('--record', metavar='DIR', help='Record every response from JIRA to a compressed file in this directory, for use with --replay.')
+parser.add_argument('--replay', metavar='DIR', help='Do not connect to JIRA. Instead, replay the responses recorded with --record in this directory. Use the same configuration and options as when recording.')
 parser.add_argument('--format', metavar='csv|json|xlsx', help="Output format for data (default CSV)")
 parser.add_argument('--cfd', metavar='cfd.csv', help='Calculate data to draw a Cumulative Flow Diagram and write to file. Hint: Plot as a (non-stacked) area chart.')
 parser.add_argument('--scatterplot', metavar='scatterplot.csv', help='Calculate data to draw a cycle time scatter plot and write to file. Hint: Plot as a scatter chart.')
 parser.add_argument('--histogram', metavar='histogram.csv', help='Calculate data to draw a cycle time histogram and write to file. Hint: Plot as a column chart.')
 parser.add_argument('--throughput', metavar='throughput.csv', help='Calculate daily throughput data and write to file. Hint: Plot as a column chart.')
 parser.add_argument('--percentiles', metavar='percentiles.csv', help='Calculate cycle time percentiles and write to file.')
+parser.add_argument('--rolling-percentiles', metavar='rolling-percentiles.csv', help='Calculate the cycle time percentiles of the items completed in a rolling window up to each day, in days, and write to file. Hint: Plot as a line chart.')
+parser.add_argument('--time-in-status', metavar='time-in-status.csv', help='Calculate the total number of days each item spent in each step of the cycle, and its flow efficiency, and write to file.')
+parser.add_argument('--group-by', metavar='<attribute>', help="Write each of the other output files and charts once for each value of this attribute (the query attribute or one of the attributes), with the value added to the file name, e.g. cfd-Team_A.csv.")
 
 parser.add_argument('--quantiles', metavar='0.3,0.5,0.75,0.85,0.95', help="Quantiles to use when calculating percentiles")
+parser.add_argument('--rolling-percentiles-window', metavar='30D', default='30D', help="Length of the window for --rolling-percentiles, e.g. 30D or 12W. Uses quantiles 0.5, 0.85 and 0.95 unless --quantiles is set.")
 parser.add_argument('--backlog-column', metavar='<name>', help="Name of the backlog column. Defaults to the first column.")
 parser.add_argument('--committed-column', metavar='<name>', help="Name of the column from which work is considered committed. Defaults to the second column.")
 parser.add_argument('--final-column', metavar='<name>', help="Name of the final 'work' column. Defaults to the penultimate column.")
 parser.add_argument('--done-column', metavar='<name>', help="Name of the 'done' column. Defaults to the last column.")
+parser.add_argument('--active-columns', metavar='<name>,<name>', help="Names of the columns where work is actively being done, used to calculate flow efficiency for --time-in-status. Defaults to all columns between the backlog and done columns.")
 parser.add_argument('--throughput-window', metavar='60', type=int, default=60, help="How many days in the past to use for calculating throughput")
 parser.add_argument('--throughput-window-end', metavar=datetime.date.today().isoformat(), help="By default, the throughput window runs to today's date. Use this option to set an alternative end date for the window.")
 
@@ -68,11 +88,14 @@ if charting.HAVE_CHARTING:
     parser.add_argument('--charts-ageing-wip', metavar='ageing-wip.png', help="Draw current ageing WIP chart")
     parser.add_argument('--charts-ageing-wip-title', metavar='"Ageing WIP"', help="Title for ageing WIP chart")
 
+    parser.add_argument('--charts-rolling-percentiles', metavar='rolling-percentiles.png', help="Draw cycle time percentiles over a rolling window (see --rolling-percentiles-window)")
+    parser.add_argument('--charts-rolling-percentiles-title', metavar='"Cycle time percentiles"', help="Title for rolling percentiles chart")
+
     parser.add_argument('--charts-net-flow', metavar='net-flow.png', help="Draw weekly net flow bar chart")
     parser.add_argument('--charts-net-flow-title', metavar='"Net flow"', help="Title for net flow bar chart`")
     parser.add_argument('--charts-net-flow-window', metavar='6', default=6, type=int, help="Number of weeks in the past for which to draw net flow chart")
 
-def get_jira_client(connection):
+def get_jira_client(connection, record=None):
     url = connection['domain']
     username = connection['username']
     password = connection['password']
@@ -89,7 +112,28 @@ def get_jira_client(connection):
     options = {'server': url}
     options.update(jira_client_options)
 
-    return JIRA(options, basic_auth=(username, password))
+    if record is None:
+        return JIRA(options, basic_auth=(username, password))
+
+    print "Recording responses from JIRA in", record
+
+    # Fetch the server info only once the session is wrapped, so that it is
+    # recorded too
+    jira = JIRA(options, basic_auth=(username, password), get_server_info=False)
+    jira._session = RecordingSession(jira._session, jira._options['server'], record)
+    jira._version = tuple(jira.server_info()['versionNumbers'])
+    return jira
+
+def get_replay_client(connection, replay):
+    print "Replaying responses from JIRA recorded in", replay
+
+    options = {'server': connection['domain'], 'check_update': False}
+    options.update(connection['jira-client-options'])
+
+    jira = JIRA(options, get_server_info=False)
+    jira._session = ReplaySession(jira._options['server'], replay)
+    jira._version = tuple(jira.server_info()['versionNumbers'])
+    return jira
 
 def to_json_string(value):
     if isinstance(value, pd.Timestamp):
@@ -104,214 +148,249 @@ def to_json_string(value):
     except TypeError:
         return value
 
-def main():
-    args = parser.parse_args()
-
-    if not args.config:
-        args.print_usage()
-        return
-
-    # Configuration
-
-    with open(args.config) as config:
-        options = config_to_options(config.read())
-
-    if args.max_results:
-        options['settings']['max_results'] = args.max_results
-
-    quantiles = [0.3, 0.5, 0.75, 0.85, 0.95]
-
-    if args.quantiles:
-        try:
-            quantiles = [float(s.strip()) for s in args.quantiles.split(',')]
-        except (AttributeError, ValueError,):
-            print "Invalid value for --quantiles"
-            args.print_usage()
-            return
-
-    output_format = args.format.lower() if args.format else 'csv'
-
-    throughput_window_end = dateutil.parser.parse(args.throughput_window_end) if args.throughput_window_end else datetime.date.today()
-    throughput_window_days = args.throughput_window
-
-    # Query JIRA
-
-    jira = get_jira_client(options['connection'])
-
-    q = CycleTimeQueries(jira, **options['settings'])
-
-    print "Fetching issues (this could take some time)"
-    cycle_data = q.cycle_data(verbose=args.verbose)
-
-    cfd_data = q.cfd(cycle_data)
-    scatter_data = q.scatterplot(cycle_data)
-    histogram_data = q.histogram(cycle_data)
-    percentile_data = q.percentiles(cycle_data, percentiles=quantiles)
-
-    daily_throughput_data = q.throughput_data(
-        cycle_data[cycle_data['completed_timestamp'] >= (throughput_window_end - datetime.timedelta(days=throughput_window_days))],
-    )
-
-    backlog_column = args.backlog_column or cfd_data.columns[0]
-    committed_column = args.committed_column or cfd_data.columns[1]
-    final_column = args.final_column or cfd_data.columns[-2]
-    done_column = args.done_column or cfd_data.columns[-1]
+def write_cycle_data(q, chunks, output, output_format):
+    """Write the cycle data output file from `chunks`, a sequence of data
+    frames with the rows of `q.cycle_data()` (see `cycle_data_chunks()`),
+    one chunk at a time.
+    """
 
     cycle_names = [s['name'] for s in q.settings['cycle']]
-    field_names = sorted(options['settings']['fields'].keys())
+    field_names = sorted(q.fields.keys())
     query_attribute_names = [q.settings['query_attribute']] if q.settings['query_attribute'] else []
 
-    # Write files
-
-    if args.output:
-        print "Writing cycle data to", args.output
+    header = ['ID', 'Link', 'Name'] + cycle_names + ['Type', 'Status', 'Resolution'] + field_names + query_attribute_names
+    columns = ['key', 'url', 'summary'] + cycle_names + ['issue_type', 'status', 'resolution'] + field_names + query_attribute_names
+
+    def output_data(chunk):
+        if 'url' not in chunk:
+            # Not included with --compact
+            chunk = chunk.assign(url=chunk['key'].map(q.issue_url))
+        return chunk
+
+    if output_format == 'xlsx':
+        output_data(pd.concat(chunks)).to_excel(output, 'Cycle data', columns=columns, header=header, index=False)
+    elif output_format == 'json':
+        # Same as `json.dumps()` of a list of the header and the rows
+        with open(output, 'w') as out:
+            out.write('[' + json.dumps(header))
+            for chunk in chunks:
+                for row in output_data(chunk)[columns].values.tolist():
+                    out.write(', ' + json.dumps(map(to_json_string, row)))
+            out.write(']')
+    else:
+        with open(output, 'w') as out:
+            for idx, chunk in enumerate(chunks):
+                output_data(chunk).to_csv(out, columns=columns, header=header if idx == 0 else False,
+                                          date_format='%Y-%m-%d', index=False, encoding='utf-8')
+
+def write_percentiles(percentile_data, output, output_format):
+    if output_format == 'json':
+        percentile_data.to_json(output, date_format='iso')
+    elif output_format == 'xlsx':
+        percentile_data.to_frame(name='percentiles').to_excel(output, 'Percentiles', header=True)
+    else:
+        percentile_data.to_csv(output, header=True)
+
+class DataSets(object):
+    """A set of named data sets, each defined as a function of other data
+    sets in the set (or in the `parent` set), which is only called the
+    first time the data set is asked for. The result is then kept, so that
+    only the data sets needed by the outputs asked for are worked out, and
+    each only once.
+    """
+
+    def __init__(self, parent=None, **values):
+        self.parent = parent
+        self.values = values
+        self.definitions = {}
+
+    def define(self, name, function, *dependencies):
+        """Define the data set `name` as the result of calling `function`
+        with the data sets named in `dependencies`.
+        """
+        self.definitions[name] = (function, dependencies,)
+
+    def __getitem__(self, name):
+        if name not in self.values:
+            if name not in self.definitions:
+                if self.parent is None:
+                    raise KeyError(name)
+                return self.parent[name]
+
+            function, dependencies = self.definitions[name]
+            self.values[name] = function(*[self[dependency] for dependency in dependencies])
+
+        return self.values[name]
+
+def write_analytics(q, args, output_format, data, quantiles, path=lambda filename: filename, title=lambda title: title):
+    """Write the data files and draw the charts asked for in `args` (other
+    than the cycle data output file) from `data`, the `DataSets` they are
+    made from: `cycle_data`, `cfd`, `scatterplot`, `histogram`,
+    `percentiles`, `throughput`, `time_in_status`, `rolling_percentiles`
+    and, for charts, `charts_cycle_data`, `charts_cfd`,
+    `charts_rolling_percentiles` (limited to `--charts-from` and
+    `--charts-to`), `wip_cfd` and `net_flow_cfd`. `path` and `title` give
+    the file name and chart title to use in place of those in `args`.
+    """
 
-        header = ['ID', 'Link', 'Name'] + cycle_names + ['Type', 'Status', 'Resolution'] + field_names + query_attribute_names
-        columns = ['key', 'url', 'summary'] + cycle_names + ['issue_type', 'status', 'resolution'] + field_names + query_attribute_names
+    cycle_names = [s['name'] for s in q.settings['cycle']]
 
-        if output_format == 'json':
-            values = [header] + [map(to_json_string, row) for row in cycle_data[columns].values.tolist()]
-            with open(args.output, 'w') as out:
-                out.write(json.dumps(values))
-        elif output_format == 'xlsx':
-            cycle_data.to_excel(args.output, 'Cycle data', columns=columns, header=header, index=False)
-        else:
-            cycle_data.to_csv(args.output, columns=columns, header=header, date_format='%Y-%m-%d', index=False)
+    backlog_column = args.backlog_column or cycle_names[0]
+    committed_column = args.committed_column or cycle_names[1]
+    final_column = args.final_column or cycle_names[-2]
+    done_column = args.done_column or cycle_names[-1]
 
     if args.cfd:
-        print "Writing Cumulative Flow Diagram data to", args.cfd
+        print "Writing Cumulative Flow Diagram data to", path(args.cfd)
+        cfd_data = data['cfd']
         if output_format == 'json':
-            cfd_data.to_json(args.cfd, date_format='iso')
+            cfd_data.to_json(path(args.cfd), date_format='iso')
         elif output_format == 'xlsx':
-            cfd_data.to_excel(args.cfd, 'CFD')
+            cfd_data.to_excel(path(args.cfd), 'CFD')
         else:
-            cfd_data.to_csv(args.cfd)
+            cfd_data.to_csv(path(args.cfd))
 
     if args.scatterplot:
-        print "Writing cycle time scatter plot data to", args.scatterplot
+        print "Writing cycle time scatter plot data to", path(args.scatterplot)
+        scatter_data = data['scatterplot']
+        if 'url' not in scatter_data:
+            # Not included with --compact
+            scatter_data.insert(list(scatter_data.columns).index('key') + 1, 'url', scatter_data['key'].map(q.issue_url))
         if output_format == 'json':
-            scatter_data.to_json(args.scatterplot, date_format='iso')
+            scatter_data.to_json(path(args.scatterplot), date_format='iso')
         elif output_format == 'xlsx':
-            scatter_data.to_excel(args.scatterplot, 'Scatter', index=False)
+            scatter_data.to_excel(path(args.scatterplot), 'Scatter', index=False)
         else:
-            scatter_data.to_csv(args.scatterplot, index=False)
+            scatter_data.to_csv(path(args.scatterplot), index=False, encoding='utf-8')
 
     if args.percentiles:
-        print "Writing cycle time percentiles", args.percentiles
+        print "Writing cycle time percentiles", path(args.percentiles)
+        write_percentiles(data['percentiles'], path(args.percentiles), output_format)
+
+    if args.histogram:
+        print "Writing cycle time histogram data to", path(args.histogram)
+        histogram_data = data['histogram']
         if output_format == 'json':
-            percentile_data.to_json(args.percentiles, date_format='iso')
+            histogram_data.to_json(path(args.histogram), date_format='iso')
         elif output_format == 'xlsx':
-            percentile_data.to_frame(name='percentiles').to_excel(args.percentiles, 'Percentiles', header=True)
+            histogram_data.to_frame(name='histogram').to_excel(path(args.histogram), 'Histogram', header=True)
         else:
-            percentile_data.to_csv(args.percentiles, header=True)
+            histogram_data.to_csv(path(args.histogram), header=True)
+
+    if args.time_in_status:
+        print "Writing time in status data to", path(args.time_in_status)
+
+        time_in_status_data = data['time_in_status'].copy()
+        for cycle_name in cycle_names:
+            time_in_status_data[cycle_name] = time_in_status_data[cycle_name] / np.timedelta64(1, 'D')
 
-    if args.histogram:
-        print "Writing cycle time histogram data to", args.histogram
         if output_format == 'json':
-            histogram_data.to_json(args.histogram, date_format='iso')
+            time_in_status_data.to_json(path(args.time_in_status), orient='records')
         elif output_format == 'xlsx':
-            histogram_data.to_frame(name='histogram').to_excel(args.histogram, 'Histogram', header=True)
+            time_in_status_data.to_excel(path(args.time_in_status), 'Time in status', index=False)
         else:
-            histogram_data.to_csv(args.histogram, header=True)
+            time_in_status_data.to_csv(path(args.time_in_status), index=False)
 
     if args.throughput:
-        print "Writing throughput data to", args.throughput
+        print "Writing throughput data to", path(args.throughput)
+        daily_throughput_data = data['throughput']
         if output_format == 'json':
-            daily_throughput_data.to_json(args.throughput, date_format='iso')
+            daily_throughput_data.to_json(path(args.throughput), date_format='iso')
         elif output_format == 'xlsx':
-            daily_throughput_data.to_excel(args.throughput, 'Throughput', header=True)
+            daily_throughput_data.to_excel(path(args.throughput), 'Throughput', header=True)
         else:
-            daily_throughput_data.to_csv(args.throughput, header=True)
+            daily_throughput_data.to_csv(path(args.throughput), header=True)
+
+    if args.rolling_percentiles:
+        print "Writing rolling cycle time percentiles to", path(args.rolling_percentiles)
+
+        rolling_percentile_days = data['rolling_percentiles'].apply(lambda percentile: percentile / np.timedelta64(1, 'D'))
+
+        if output_format == 'json':
+            rolling_percentile_days.to_json(path(args.rolling_percentiles), date_format='iso')
+        elif output_format == 'xlsx':
+            rolling_percentile_days.to_excel(path(args.rolling_percentiles), 'Rolling percentiles')
+        else:
+            rolling_percentile_days.to_csv(path(args.rolling_percentiles))
 
     # Output charts (if we have the right things installed)
     if charting.HAVE_CHARTING:
-    
-        charts_from = dateutil.parser.parse(args.charts_from) if args.charts_from is not None else None
-        charts_to = dateutil.parser.parse(args.charts_to) if args.charts_to is not None else None
-    
-        cycle_data_sliced = cycle_data
-        if charts_from is not None:
-            cycle_data_sliced = cycle_data[cycle_data['completed_timestamp'] >= charts_from]
-        if charts_to is not None:
-            cycle_data_sliced = cycle_data_sliced[cycle_data_sliced['completed_timestamp'] <= charts_to]
-        
-        cfd_data_sliced = cfd_data[slice(charts_from, charts_to)]
-        
+
         charting.set_context()
 
         if args.charts_scatterplot:
-            print "Drawing scatterplot in", args.charts_scatterplot
+            print "Drawing scatterplot in", path(args.charts_scatterplot)
             charting.set_style('darkgrid')
             try:
                 ax = charting.cycle_time_scatterplot(
-                    cycle_data_sliced,
+                    data['charts_cycle_data'],
                     percentiles=quantiles,
-                    title=args.charts_scatterplot_title
+                    title=title(args.charts_scatterplot_title)
                 )
             except charting.UnchartableData, e:
                 print "** WARNING: Did not draw chart:", e
             else:
                 fig = ax.get_figure()
-                fig.savefig(args.charts_scatterplot, bbox_inches='tight', dpi=300)
+                fig.savefig(path(args.charts_scatterplot), bbox_inches='tight', dpi=300)
 
         if args.charts_histogram:
-            print "Drawing histogram in", args.charts_histogram
+            print "Drawing histogram in", path(args.charts_histogram)
             charting.set_style('darkgrid')
             try:
                 ax = charting.cycle_time_histogram(
-                    cycle_data_sliced,
+                    data['charts_cycle_data'],
                     percentiles=quantiles,
-                    title=args.charts_histogram_title
+                    title=title(args.charts_histogram_title)
                 )
             except charting.UnchartableData, e:
                 print "** WARNING: Did not draw chart:", e
             else:
                 fig = ax.get_figure()
-                fig.savefig(args.charts_histogram, bbox_inches='tight', dpi=300)
+                fig.savefig(path(args.charts_histogram), bbox_inches='tight', dpi=300)
 
         if args.charts_cfd:
-            print "Drawing CFD in", args.charts_cfd
+            print "Drawing CFD in", path(args.charts_cfd)
             charting.set_style('whitegrid')
             try:
                 ax = charting.cfd(
-                    cfd_data_sliced,
-                    title=args.charts_cfd_title
+                    data['charts_cfd'],
+                    title=title(args.charts_cfd_title)
                 )
             except charting.UnchartableData, e:
                 print "** WARNING: Did not draw chart:", e
             else:
                 fig = ax.get_figure()
-                fig.savefig(args.charts_cfd, bbox_inches='tight', dpi=300)
+                fig.savefig(path(args.charts_cfd), bbox_inches='tight', dpi=300)
 
         if args.charts_throughput:
-            print "Drawing throughput chart in", args.charts_throughput
+            print "Drawing throughput chart in", path(args.charts_throughput)
             charting.set_style('darkgrid')
             try:
                 ax = charting.throughput_trend_chart(
-                    daily_throughput_data,
-                    title=args.charts_throughput_title
+                    data['throughput'],
+                    title=title(args.charts_throughput_title)
                 )
             except charting.UnchartableData, e:
                 print "** WARNING: Did not draw chart:", e
             else:
                 fig = ax.get_figure()
-                fig.savefig(args.charts_throughput, bbox_inches='tight', dpi=300)
+                fig.savefig(path(args.charts_throughput), bbox_inches='tight', dpi=300)
 
         if args.charts_burnup:
-            print "Drawing burnup chart in", args.charts_burnup
+            print "Drawing burnup chart in", path(args.charts_burnup)
             charting.set_style('whitegrid')
             try:
                 ax = charting.burnup(
-                    cfd_data_sliced,
+                    data['charts_cfd'],
                     backlog_column=backlog_column,
                     done_column=done_column,
-                    title=args.charts_burnup_title
+                    title=title(args.charts_burnup_title)
                 )
             except charting.UnchartableData, e:
                 print "** WARNING: Did not draw chart:", e
             else:
                 fig = ax.get_figure()
-                fig.savefig(args.charts_burnup, bbox_inches='tight', dpi=300)
+                fig.savefig(path(args.charts_burnup), bbox_inches='tight', dpi=300)
 
         if args.charts_burnup_forecast:
             target = args.charts_burnup_forecast_target or None
@@ -319,12 +398,12 @@ def main():
             deadline = dateutil.parser.parse(args.charts_burnup_forecast_deadline) if args.charts_burnup_forecast_deadline else None
             deadline_confidence = args.charts_burnup_forecast_deadline_confidence
             
-            print "Drawing burnup forecast chart in", args.charts_burnup_forecast
+            print "Drawing burnup forecast chart in", path(args.charts_burnup_forecast)
             charting.set_style('whitegrid')
             try:
                 ax = charting.burnup_forecast(
-                    cfd_data_sliced,
-                    daily_throughput_data,
+                    data['charts_cfd'],
+                    data['throughput'],
                     trials=trials,
                     target=target,
                     backlog_column=backlog_column,
@@ -332,61 +411,333 @@ def main():
                     percentiles=quantiles,
                     deadline=deadline,
                     deadline_confidence=deadline_confidence,
-                    title=args.charts_burnup_forecast_title
+                    title=title(args.charts_burnup_forecast_title)
                 )
             except charting.UnchartableData, e:
                 print "** WARNING: Did not draw chart:", e
             else:
                 fig = ax.get_figure()
-                fig.savefig(args.charts_burnup_forecast, bbox_inches='tight', dpi=300)
+                fig.savefig(path(args.charts_burnup_forecast), bbox_inches='tight', dpi=300)
 
         if args.charts_wip:
-            print "Drawing WIP chart in", args.charts_wip
+            print "Drawing WIP chart in", path(args.charts_wip)
             charting.set_style('darkgrid')
             try:
                 ax = charting.wip_chart(
-                    q.cfd(cycle_data[cycle_data[backlog_column] >= (datetime.date.today() - datetime.timedelta(weeks=(args.charts_wip_window or 6)))]),
+                    data['wip_cfd'],
                     start_column=committed_column,
                     end_column=final_column,
-                    title=args.charts_wip_title
+                    title=title(args.charts_wip_title)
                 )
             except charting.UnchartableData, e:
                 print "** WARNING: Did not draw chart:", e
             else:
                 fig = ax.get_figure()
-                fig.savefig(args.charts_wip, bbox_inches='tight', dpi=300)
+                fig.savefig(path(args.charts_wip), bbox_inches='tight', dpi=300)
 
         if args.charts_ageing_wip:
-            print "Drawing ageing WIP chart in", args.charts_ageing_wip
+            print "Drawing ageing WIP chart in", path(args.charts_ageing_wip)
             charting.set_style('whitegrid')
             try:
                 ax = charting.ageing_wip_chart(
-                    cycle_data,
+                    data['cycle_data'],
                     start_column=committed_column,
                     end_column=final_column,
                     done_column=done_column,
-                    title=args.charts_ageing_wip_title
+                    title=title(args.charts_ageing_wip_title)
                 )
             except charting.UnchartableData, e:
                 print "** WARNING: Did not draw chart:", e
             else:
                 fig = ax.get_figure()
-                fig.savefig(args.charts_ageing_wip, bbox_inches='tight', dpi=300)
+                fig.savefig(path(args.charts_ageing_wip), bbox_inches='tight', dpi=300)
 
         if args.charts_net_flow:
-            print "Drawing net flow chart in", args.charts_net_flow
+            print "Drawing net flow chart in", path(args.charts_net_flow)
             charting.set_style('darkgrid')
             try:
                 ax = charting.net_flow_chart(
-                    q.cfd(cycle_data[cycle_data[backlog_column] >= (datetime.date.today() - datetime.timedelta(weeks=(args.charts_net_flow_window or 6)))]),
+                    data['net_flow_cfd'],
                     start_column=committed_column,
                     end_column=done_column,
-                    title=args.charts_net_flow_title
+                    title=title(args.charts_net_flow_title)
+                )
+            except charting.UnchartableData, e:
+                print "** WARNING: Did not draw chart:", e
+            else:
+                fig = ax.get_figure()
+                fig.savefig(path(args.charts_net_flow), bbox_inches='tight', dpi=300)
+
+        if args.charts_rolling_percentiles:
+            print "Drawing rolling percentiles chart in", path(args.charts_rolling_percentiles)
+            charting.set_style('darkgrid')
+            try:
+                ax = charting.rolling_percentiles_chart(
+                    data['charts_rolling_percentiles'],
+                    title=title(args.charts_rolling_percentiles_title)
                 )
             except charting.UnchartableData, e:
                 print "** WARNING: Did not draw chart:", e
             else:
                 fig = ax.get_figure()
-                fig.savefig(args.charts_net_flow, bbox_inches='tight', dpi=300)
+                fig.savefig(path(args.charts_rolling_percentiles), bbox_inches='tight', dpi=300)
+
+def group_name(group):
+    """Return the name of the group of items with the value `group` of the
+    `--group-by` attribute, for output.
+    """
+    return u"(none)" if group is None else unicode(group)
+
+def group_file_labels(groups):
+    """Return a label for each value in `groups` to add to output file
+    names (see `output_path()`): the characters of the group name that are
+    safe in file names, made unique.
+    """
+
+    labels = []
+    for group in groups:
+        label = re.sub(r'[^\w.-]+', '_', group_name(group), flags=re.UNICODE).strip('_').encode('utf-8') or 'none'
+        unique, count = label, 1
+        while unique in labels:
+            count += 1
+            unique = "%s-%d" % (label, count,)
+        labels.append(unique)
+
+    return labels
+
+def output_path(path, label):
+    """Return `path` with `label` added to the file name, e.g.
+    `cfd-Team_A.csv` for `cfd.csv` and `Team_A`.
+    """
+    base, ext = os.path.splitext(path)
+    return "%s-%s%s" % (base, label, ext,)
+
+def write_outputs(q, args, output_format, cycle_data, quantiles, rolling_quantiles, throughput_window_end, throughput_window_days):
+    """Write the cycle data and each output and chart requested in `args`
+    (for each group, with `--group-by`) for `cycle_data`.
+    """
+
+    throughput_window_start = pd.Timestamp(throughput_window_end - datetime.timedelta(days=throughput_window_days))
+
+    if args.output:
+        print "Writing cycle data to", args.output
+        write_cycle_data(q, [cycle_data], args.output, output_format)
+
+    # Data sets for all items and groups of items, worked out only if an
+    # output or chart needs them
+    shared = DataSets(cycle_data=cycle_data)
+
+    # Count items entering each step and completed once, by day (and by
+    # hour if the throughput window doesn't start at midnight), and group
+    shared.define('flow_cube', lambda cycle_data: q.flow_cube(cycle_data, group_by=args.group_by,
+        resolutions=('D',) if throughput_window_start == throughput_window_start.normalize() else ('H', 'D',)
+    ), 'cycle_data')
+
+    active_steps = [s.strip() for s in args.active_columns.split(',')] if args.active_columns else None
+    shared.define('time_in_status', lambda: q.time_in_status(active_steps=active_steps, verbose=args.verbose))
+
+    # Percentiles and histograms for all groups at once
+    shared.define('groups', lambda cycle_data: q.cycle_data_groups(cycle_data, args.group_by), 'cycle_data')
+    shared.define('group_percentiles', lambda groups: groups.percentiles(quantiles), 'groups')
+    shared.define('group_histograms', lambda groups: groups.histograms(), 'groups')
+
+    def throughput(flow_cube, cycle_data, groups=None):
+        try:
+            return flow_cube.throughput('1D', start=throughput_window_start, groups=groups)
+        except ValueError:  # the window doesn't start on the hour
+            return q.throughput_data(cycle_data[cycle_data['completed_timestamp'] >= throughput_window_start])
+
+    if charting.HAVE_CHARTING:
+        charts_from = dateutil.parser.parse(args.charts_from) if args.charts_from is not None else None
+        charts_to = dateutil.parser.parse(args.charts_to) if args.charts_to is not None else None
+
+        def charts_cycle_data(cycle_data):
+            if charts_from is not None:
+                cycle_data = cycle_data[cycle_data['completed_timestamp'] >= charts_from]
+            if charts_to is not None:
+                cycle_data = cycle_data[cycle_data['completed_timestamp'] <= charts_to]
+            return cycle_data
+
+        def recent(cfd_data, weeks):
+            return cfd_data[slice(pd.Timestamp(datetime.date.today() - datetime.timedelta(weeks=weeks)), None)]
+
+    def analytics(groups=None):
+        """Return the `DataSets` for the items in the list of `groups` (see
+        `FlowCube`), or all items.
+        """
+
+        data = DataSets(parent=shared)
+
+        if groups is None:
+            data.define('percentiles', lambda cycle_data: q.percentiles(cycle_data, percentiles=quantiles), 'cycle_data')
+            data.define('histogram', q.histogram, 'cycle_data')
+        else:
+            group, = groups
+            data.define('cycle_data', lambda cycle_data_groups: cycle_data_groups.frame(group), 'groups')
+            data.define('percentiles', lambda group_percentiles: group_percentiles[group], 'group_percentiles')
+            data.define('histogram', lambda group_histograms: group_histograms[group], 'group_histograms')
+            data.define('time_in_status', lambda cycle_data: (
+                shared['time_in_status'][shared['time_in_status']['key'].isin(cycle_data['key'])]
+            ), 'cycle_data')
+
+        data.define('cfd', lambda flow_cube: flow_cube.cfd(groups=groups), 'flow_cube')
+        data.define('scatterplot', q.scatterplot, 'cycle_data')
+        data.define('throughput', lambda flow_cube, cycle_data: throughput(flow_cube, cycle_data, groups), 'flow_cube', 'cycle_data')
+        data.define('rolling_percentiles', lambda cycle_data: q.rolling_percentiles(cycle_data, window=args.rolling_percentiles_window, quantiles=rolling_quantiles), 'cycle_data')
+
+        if charting.HAVE_CHARTING:
+            data.define('charts_cycle_data', charts_cycle_data, 'cycle_data')
+            data.define('charts_cfd', lambda cfd_data: cfd_data[slice(charts_from, charts_to)], 'cfd')
+            data.define('charts_rolling_percentiles', lambda rolling_percentile_data: rolling_percentile_data[slice(charts_from, charts_to)], 'rolling_percentiles')
+
+            # The last few weeks of the CFD, for charts of the changes in it
+            data.define('wip_cfd', lambda cfd_data: recent(cfd_data, args.charts_wip_window or 6), 'cfd')
+            data.define('net_flow_cfd', lambda cfd_data: recent(cfd_data, args.charts_net_flow_window or 6), 'cfd')
+
+        return data
+
+    if not args.group_by:
+        write_analytics(q, args, output_format, analytics(), quantiles)
+    else:
+        groups = shared['groups'].groups
+        for group, label in zip(groups, group_file_labels(groups)):
+            print "Writing data for %s %s" % (args.group_by, group_name(group).encode('utf-8'),)
+            write_analytics(q, args, output_format, analytics(groups=[group]), quantiles,
+                path=lambda filename: output_path(filename, label),
+                title=lambda title: u"%s: %s" % (title, group_name(group),) if title else group_name(group)
+            )
+
+def main():
+    args = parser.parse_args()
+
+    if not args.config:
+        args.print_usage()
+        return
+
+    # Configuration
+
+    with open(args.config) as config:
+        options = config_to_options(config.read())
+
+    if args.max_results:
+        options['settings']['max_results'] = args.max_results
+
+    options['settings']['concurrency'] = args.concurrency or options['connection']['concurrency']
+    options['settings']['max_retries'] = options['connection']['max-retries']
+    options['settings']['backend'] = args.backend or options['connection']['backend']
+
+    if args.query_concurrency:
+        options['settings']['query_concurrency'] = args.query_concurrency
+
+    if args.combine_queries:
+        options['settings']['combine_queries'] = True
+
+    if args.processes:
+        options['settings']['processes'] = args.processes
+
+    if args.compact:
+        options['settings']['compact'] = True
+
+    if args.record and args.replay:
+        print "Cannot use --record and --replay at the same time"
+        return
+
+    if args.cache and args.replay:
+        print "Ignoring --cache when replaying recorded responses"
+    elif args.cache:
+        options['settings']['cache_dir'] = args.cache
+        options['settings']['full_refresh'] = args.full_refresh
+
+    quantiles = [0.3, 0.5, 0.75, 0.85, 0.95]
+    rolling_quantiles = [0.5, 0.85, 0.95]
+
+    if args.quantiles:
+        try:
+            quantiles = rolling_quantiles = [float(s.strip()) for s in args.quantiles.split(',')]
+        except (AttributeError, ValueError,):
+            print "Invalid value for --quantiles"
+            args.print_usage()
+            return
+
+    try:
+        pd.Timedelta(args.rolling_percentiles_window)
+    except ValueError:
+        print "Invalid value for --rolling-percentiles-window"
+        return
+
+    if args.group_by and args.group_by not in [options['settings']['query_attribute']] + list(options['settings']['fields'].keys()):
+        print "Invalid value for --group-by: must be the query attribute or one of the attributes"
+        return
+
+    output_format = args.format.lower() if args.format else 'csv'
+
+    throughput_window_end = dateutil.parser.parse(args.throughput_window_end) if args.throughput_window_end else datetime.date.today()
+    throughput_window_days = args.throughput_window
+
+    if args.stream:
+        other_outputs = [
+            args.cfd, args.scatterplot, args.histogram, args.throughput, args.time_in_status, args.rolling_percentiles,
+        ] + [
+            getattr(args, name, None) for name in (
+                'charts_scatterplot', 'charts_histogram', 'charts_cfd', 'charts_throughput', 'charts_burnup',
+                'charts_burnup_forecast', 'charts_wip', 'charts_ageing_wip', 'charts_net_flow', 'charts_rolling_percentiles',
+            )
+        ]
+
+        if not args.output or any(other_outputs) or output_format == 'xlsx':
+            print "--stream can only be used to write the cycle data output file, in CSV or JSON format, and percentiles"
+            return
+
+    # Query JIRA
+
+    try:
+        if args.replay:
+            jira = get_replay_client(options['connection'], args.replay)
+        else:
+            jira = get_jira_client(options['connection'], record=args.record)
+
+        q = CycleTimeQueries(jira, **options['settings'])
+
+        if args.stream:
+            print "Fetching issues and writing cycle data to", args.output
+
+            # Percentiles are estimated from a sketch of the cycle times (of
+            # each group)
+            sketch = QuantileSketch()
+            group_sketches, groups = {}, []
+
+            def chunks():
+                for chunk in q.cycle_data_chunks(verbose=args.verbose):
+                    if args.group_by:
+                        chunk_groups = q.cycle_data_groups(chunk, args.group_by)
+                        for group, positions in zip(chunk_groups.groups, chunk_groups.positions):
+                            if group not in group_sketches:
+                                group_sketches[group] = QuantileSketch()
+                                groups.append(group)
+                            q.cycle_time_sketch(chunk.take(positions), group_sketches[group])
+                    else:
+                        q.cycle_time_sketch(chunk, sketch)
+                    yield chunk
+
+            write_cycle_data(q, chunks(), args.output, output_format)
+
+            if args.percentiles and not args.group_by:
+                print "Writing approximate cycle time percentiles", args.percentiles
+                write_percentiles(q.percentiles(None, percentiles=quantiles, sketch=sketch), args.percentiles, output_format)
+            elif args.percentiles:
+                # In order of appearance, with any missing value last
+                groups.sort(key=lambda group: group is None)
+                for group, label in zip(groups, group_file_labels(groups)):
+                    print "Writing approximate cycle time percentiles for %s %s to" % (args.group_by, group_name(group).encode('utf-8'),), output_path(args.percentiles, label)
+                    write_percentiles(q.percentiles(None, percentiles=quantiles, sketch=group_sketches[group]), output_path(args.percentiles, label), output_format)
+        else:
+            print "Fetching issues (this could take some time)"
+            cycle_data = q.cycle_data(verbose=args.verbose)
+    except ReplayError, e:
+        print "** ERROR: Cannot replay recorded responses:", e
+        return
+
+    if not args.stream:
+        write_outputs(q, args, output_format, cycle_data, quantiles, rolling_quantiles, throughput_window_end, throughput_window_days)
 
     print "Done"
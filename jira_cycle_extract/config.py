@@ -25,6 +25,9 @@ def ordered_load(stream, Loader=yaml.Loader, object_pairs_hook=odicti):
 def force_list(val):
     return val if isinstance(val, (list, tuple,)) else [val]
 
+def force_text(val):
+    return val if val is None else unicode(val)
+
 def config_to_options(data):
     config = ordered_load(data, yaml.SafeLoader)
     options = {
@@ -32,11 +35,16 @@ def config_to_options(data):
             'domain': None,
             'username': None,
             'password': None,
-            'jira-client-options': {}
+            'jira-client-options': {},
+            'concurrency': 1,
+            'max-retries': 5,
+            'backend': 'resources',
         },
         'settings': {
             'queries': [],
             'query_attribute': None,
+            'query_concurrency': 1,
+            'combine_queries': False,
             'fields': {},
             'known_values': {},
             'cycle': []
@@ -62,14 +70,47 @@ def config_to_options(data):
     if 'jira-client-options' in config['connection']:
         options['connection']['jira-client-options'] = config['connection']['jira-client-options']
 
+    if 'concurrency' in config['connection']:
+        try:
+            options['connection']['concurrency'] = int(config['connection']['concurrency'])
+        except (TypeError, ValueError,):
+            raise ConfigError("`Concurrency` in the `Connection` section must be a number")
+
+        if options['connection']['concurrency'] < 1:
+            raise ConfigError("`Concurrency` in the `Connection` section must be at least 1")
+
+    if 'max retries' in config['connection']:
+        try:
+            options['connection']['max-retries'] = int(config['connection']['max retries'])
+        except (TypeError, ValueError,):
+            raise ConfigError("`Max retries` in the `Connection` section must be a number")
+
+    if 'backend' in config['connection']:
+        options['connection']['backend'] = config['connection']['backend'].lower()
+        if options['connection']['backend'] not in ('resources', 'json',):
+            raise ConfigError("`Backend` in the `Connection` section must be either `resources` or `json`")
+
     # Parse Queries (list of Criteria) and/or a single Criteria
 
     if 'queries' in config:
         options['settings']['query_attribute'] = config['queries'].get('attribute', None)
+
+        if 'concurrency' in config['queries']:
+            try:
+                options['settings']['query_concurrency'] = int(config['queries']['concurrency'])
+            except (TypeError, ValueError,):
+                raise ConfigError("`Concurrency` in the `Queries` section must be a number")
+
+            if options['settings']['query_concurrency'] < 1:
+                raise ConfigError("`Concurrency` in the `Queries` section must be at least 1")
+
+        if 'combine' in config['queries']:
+            options['settings']['combine_queries'] = bool(config['queries']['combine'])
+
         for query in config['queries']['criteria']:
             options['settings']['queries'].append({
                 'value': query.get('value', None),
-                'project': query.get('project', None),
+                'project': force_text(query.get('project', None)),
                 'issue_types': force_list(query.get('issue types', [])),
                 'valid_resolutions': force_list(query.get('valid resolutions', [])),
                 'jql_filter': query.get('jql', None)
@@ -78,7 +119,7 @@ def config_to_options(data):
     if 'criteria' in config:
         options['settings']['queries'].append({
             'value': config['criteria'].get('value', None),
-            'project': config['criteria'].get('project', None),
+            'project': force_text(config['criteria'].get('project', None)),
             'issue_types': force_list(config['criteria'].get('issue types', [])),
             'valid_resolutions': force_list(config['criteria'].get('valid resolutions', [])),
             'jql_filter': config['criteria'].get('jql', None)
@@ -1,4 +1,9 @@
-from .query import QueryManager
+import bisect
+import datetime
+import multiprocessing
+
+from .query import QueryManager, IssueRecord, UTC, to_nanoseconds
+from .sketch import QuantileSketch, interpolate
 import pandas as pd
 import numpy as np
 
@@ -7,6 +12,468 @@ class StatusTypes:
     accepted = 'accepted'
     complete = 'complete'
 
+NaT = np.iinfo(np.int64).min
+HOUR = 3600 * 1000000000  # in nanoseconds
+DAY = 24 * HOUR
+
+class CycleDataBuilder(object):
+    """Collects the rows of `cycle_data()` in columns allocated up front
+    for `size` rows: datetimes and time deltas as nanoseconds in `int64`
+    arrays, the issue type, status, resolution and query attribute as
+    codes into a list of the distinct values, and other values in object
+    arrays. The data frame is then built from these without converting
+    each value.
+
+    If `compact` is set, the coded columns and the `field_names` columns
+    are returned as categoricals, summaries are left as unicode instead of
+    being encoded as UTF-8, and there is no `url` column.
+    """
+
+    def __init__(self, size, cycle_names, field_names, query_attribute=None, compact=False):
+        self.size = size
+        self.length = 0
+
+        self.cycle_names = list(cycle_names)
+        self.field_names = list(field_names)
+        self.query_attribute = query_attribute
+        self.compact = compact
+
+        coded = ['issue_type', 'status', 'resolution'] + ([query_attribute] if query_attribute else [])
+        if compact:
+            coded += self.field_names
+
+        self.objects = dict((name, np.empty(size, dtype=object),) for name in ['key', 'url', 'summary'] + self.field_names if name not in coded and not (compact and name == 'url'))
+        self.codes = dict((name, np.empty(size, dtype=np.int32),) for name in coded)
+        self.values = dict((name, {},) for name in self.codes)
+        self.times = dict((name, np.empty(size, dtype=np.int64),) for name in self.cycle_names + ['completed_timestamp', 'cycle_time'])
+
+    def __len__(self):
+        return self.length
+
+    def append(self, record, url, query_value, timestamps, cycle_time, completed_timestamp):
+        """Add a row for the `IssueRecord` `record`, where `timestamps`
+        are the datetimes it entered each step in the cycle (or `None`).
+        """
+
+        idx = self.length
+        if idx >= self.size:
+            raise IndexError("Cycle data builder is full (%d rows)" % self.size)
+
+        objects, codes, times = self.objects, self.codes, self.times
+
+        objects['key'][idx] = record.key
+
+        if self.compact:
+            objects['summary'][idx] = record.summary
+            for name in self.field_names:
+                codes[name][idx] = self._code(name, record.values[name])
+        else:
+            objects['url'][idx] = url
+            objects['summary'][idx] = record.summary.encode('utf-8')
+            for name in self.field_names:
+                objects[name][idx] = record.values[name]
+
+        codes['issue_type'][idx] = self._code('issue_type', record.issue_type)
+        codes['status'][idx] = self._code('status', record.status)
+        codes['resolution'][idx] = self._code('resolution', record.resolution)
+        if self.query_attribute:
+            codes[self.query_attribute][idx] = self._code(self.query_attribute, query_value)
+
+        for name, timestamp in zip(self.cycle_names, timestamps):
+            times[name][idx] = to_nanoseconds(timestamp) if timestamp is not None else NaT
+
+        times['completed_timestamp'][idx] = to_nanoseconds(completed_timestamp) if completed_timestamp is not None else NaT
+        times['cycle_time'][idx] = (
+            (cycle_time.days * 86400 + cycle_time.seconds) * 1000000000 + cycle_time.microseconds * 1000
+            if cycle_time is not None else NaT
+        )
+
+        self.length += 1
+
+    def extend(self, other):
+        """Add the rows collected by another builder (with the same
+        columns) to the end of this one.
+        """
+
+        start, end = self.length, self.length + other.length
+        if end > self.size:
+            raise IndexError("Cycle data builder is full (%d rows)" % self.size)
+
+        for name, values in other.objects.items():
+            self.objects[name][start:end] = values[:other.length]
+
+        for name, codes in other.codes.items():
+            mapping = np.empty(len(other.values[name]), dtype=np.int32)
+            for (value_type, value), code in other.values[name].items():
+                mapping[code] = self._code(name, value)
+            self.codes[name][start:end] = mapping.take(codes[:other.length])
+
+        for name, values in other.times.items():
+            self.times[name][start:end] = values[:other.length]
+
+        self.length = end
+
+    def frame(self, columns, categorical=True):
+        """Return a DataFrame with the given `columns` from the rows added.
+        If `categorical` is false, no columns are categoricals, even if
+        `compact` is set.
+        """
+
+        length = self.length
+        data = {}
+
+        for name, values in self.objects.items():
+            data[name] = pd.Series(values[:length], dtype='object')
+
+        for name, codes in self.codes.items():
+            values = np.empty(len(self.values[name]), dtype=object)
+            for (value_type, value), code in self.values[name].items():
+                values[code] = value
+            series = self._categorical(values, codes[:length]) if self.compact and categorical else None
+            if series is None:
+                series = pd.Series(values.take(codes[:length]), dtype='object')
+            data[name] = series
+
+        for name, values in self.times.items():
+            data[name] = pd.Series(values[:length].view('timedelta64[ns]' if name == 'cycle_time' else 'datetime64[ns]'))
+
+        return pd.DataFrame(data, columns=columns)
+
+    def _code(self, name, value):
+        # Keyed by type as well, so that e.g. 1 and True are kept apart
+        key = (value.__class__.__name__, value,)
+        values = self.values[name]
+        try:
+            return values[key]
+        except KeyError:
+            return values.setdefault(key, len(values))
+
+    def _categorical(self, values, codes):
+        """Return a categorical series of `values.take(codes)`, with `None`
+        as a missing value, or `None` if the values can't be categories
+        (e.g. because they include both 1 and 1.0).
+
+        The categories are kept as objects, so that e.g. 13 isn't turned
+        into 13.0 when it is alongside 1.5.
+        """
+
+        present = np.array([value is not None for value in values], dtype=np.bool_)
+        remap = np.where(present, np.cumsum(present) - 1, -1)
+
+        try:
+            categorical = pd.Categorical.from_codes(remap.take(codes), pd.Index(values[present], dtype=object))
+        except (ValueError, TypeError,):
+            return None
+
+        return pd.Series(categorical)
+
+def _entry_times(cycle_data, cycle_names):
+    """Return an array of nanoseconds with a row for each row of
+    `cycle_data` and a column for each of `cycle_names`, where a missing
+    time is taken from the next step with one, or `NaT` if there is none.
+    """
+
+    times = np.empty((len(cycle_data), len(cycle_names),), dtype=np.int64)
+    following = np.empty(len(cycle_data), dtype=np.int64)
+    following.fill(NaT)
+
+    for idx in range(len(cycle_names) - 1, -1, -1):
+        values = np.asarray(cycle_data[cycle_names[idx]].values, dtype='<M8[ns]').view(np.int64)
+        times[:, idx] = np.where(values == NaT, following, values)
+        following = times[:, idx]
+
+    return times
+
+def _group_codes(cycle_data, group_by):
+    """Return an array with the number of the group of each row of
+    `cycle_data`, by the value in the column `group_by`, and the list of
+    values, in order of appearance, with `None` last for any missing value.
+    """
+
+    codes, groups = pd.factorize(np.asarray(cycle_data[group_by].values, dtype=object))
+    groups = list(groups)
+    if (codes < 0).any():
+        codes[codes < 0] = len(groups)
+        groups.append(None)
+
+    return codes, groups
+
+def _cumulative_frame(counts, first_day, cycle_names):
+    """Return the CFD for `counts`, an array with the number of items
+    entering each of `cycle_names` on each day from `first_day` on (as days
+    since the epoch): a DataFrame indexed by day (with a daily frequency)
+    from the first to the last day on which any item entered a step, with
+    the cumulative count for each step as columns.
+
+    As with counting the dates in each column and aligning the counts, the
+    counts are integers if every step has a count for every day on which
+    any step has one, and floats otherwise.
+    """
+
+    entered = counts != 0
+    any_entered = entered.any(axis=1)
+
+    if not any_entered.any():
+        return pd.DataFrame(columns=cycle_names, index=pd.DatetimeIndex([], freq='D'))
+
+    first, last = np.flatnonzero(any_entered)[[0, -1]]
+    counts = counts[first:last + 1]
+    entered = entered[first:last + 1][any_entered[first:last + 1]]
+
+    values = counts.cumsum(axis=0)
+    if not entered.all():
+        values = values.astype(np.float64)
+
+    index = pd.date_range(pd.Timestamp((first_day + first) * DAY), periods=len(counts), freq='D')
+    return pd.DataFrame(values, index=index, columns=cycle_names)
+
+class FlowCube(object):
+    """The number of items entering each step in the cycle, and the number
+    completed, in each hour, day and week, for each group of items, counted
+    in one pass over the cycle data. The CFD and throughput at each of
+    these resolutions, for all items or any one group, are then sums and
+    slices of the counts, rather than being worked out from the cycle data
+    again.
+
+    As for the CFD, an item that skipped a step is counted as entering it
+    when it entered the next step. Items are completed at their
+    `completed_timestamp`. If `group_by` is set, items are grouped by the
+    value in that column of the cycle data (e.g. the query attribute),
+    and the values are listed in `groups` in order of appearance, with any
+    missing value last as `None`. Otherwise there is one group, `None`.
+
+    For each resolution in `resolutions` (any of 'H', 'D' and 'W'), the
+    counts are kept in `counts[resolution]`, an array indexed by bucket
+    (from `first[resolution]`, counting from the epoch), step (with
+    completions last) and group. Weeks run from Monday to Sunday.
+    """
+
+    frequencies = {'H': 'H', 'D': 'D', 'W': 'W'}
+    bucket_sizes = {'H': HOUR, 'D': DAY, 'W': 7 * DAY}
+
+    def __init__(self, cycle_names, cycle_data, group_by=None, resolutions=('H', 'D', 'W',)):
+        self.cycle_names = list(cycle_names)
+        self.group_by = group_by
+
+        times = np.empty((len(cycle_data), len(self.cycle_names) + 1,), dtype=np.int64)
+        times[:, :-1] = _entry_times(cycle_data, self.cycle_names)
+        times[:, -1] = np.asarray(cycle_data['completed_timestamp'].values, dtype='<M8[ns]').view(np.int64)
+
+        if group_by is not None:
+            codes, self.groups = _group_codes(cycle_data, group_by)
+        else:
+            codes = np.zeros(len(cycle_data), dtype=np.int64)
+            self.groups = [None]
+
+        rows, steps = np.nonzero(times != NaT)
+        times, codes = times[rows, steps], codes[rows]
+        shape = (len(self.cycle_names) + 1, len(self.groups),)
+
+        self.counts = {}
+        self.first = {}
+
+        for resolution in resolutions:
+            buckets = self._bucket(resolution, times)
+            first = buckets.min() if len(buckets) else 0
+            length = (buckets.max() - first + 1) if len(buckets) else 0
+            size = length * shape[0] * shape[1]
+
+            cells = ((buckets - first) * shape[0] + steps) * shape[1] + codes
+            self.counts[resolution] = np.bincount(cells, minlength=max(size, 1))[:size].reshape((length,) + shape)
+            self.first[resolution] = first
+
+    def cfd(self, groups=None):
+        """Return the same data frame as `CycleTimeQueries.cfd()` for the
+        cycle data of the items in the list of `groups`, or all items if
+        `groups` is `None`.
+        """
+        return _cumulative_frame(self._counts('D', groups)[:, :-1], self.first['D'], self.cycle_names)
+
+    def throughput(self, frequency='1D', start=None, groups=None):
+        """Return the same data frame as `CycleTimeQueries.throughput_data()`
+        for the cycle data of the items in the list of `groups` (or all
+        items, if `groups` is `None`) completed at or after `start` (if
+        given), for an hourly, daily or weekly `frequency`.
+
+        Raises `ValueError` if the frequency isn't one of those, or there is
+        no resolution in the cube for which `start` is at the start of a
+        bucket and no coarser than `frequency`.
+        """
+
+        target = None
+        offset = pd.tseries.frequencies.to_offset(frequency)
+        for resolution, name in self.frequencies.items():
+            if offset == pd.tseries.frequencies.to_offset(name):
+                target = resolution
+
+        if target is None:
+            raise ValueError("Throughput can only be counted from the flow cube by hour, day or week, not %s" % frequency)
+
+        start = pd.Timestamp(start).value if start is not None else None
+
+        # The coarsest resolution we can use to count from `start`
+        candidates = sorted(
+            (r for r in self.counts if self.bucket_sizes[r] <= self.bucket_sizes[target]),
+            key=lambda r: self.bucket_sizes[r],
+            reverse=True
+        )
+        for resolution in candidates:
+            if start is None or self._bucket_start(resolution, self._bucket(resolution, start)) == start:
+                break
+        else:
+            raise ValueError("Cannot count throughput by %s from %s with resolutions %s" % (frequency, pd.Timestamp(start), sorted(self.counts.keys()),))
+
+        completed = self._counts(resolution, groups)[:, -1]
+        starts = self._bucket_start(resolution, self.first[resolution] + np.arange(len(completed)))
+        if start is not None:
+            completed, starts = completed[starts >= start], starts[starts >= start]
+
+        buckets = self._bucket(target, starts)
+        nonzero = completed != 0
+
+        if not nonzero.any():
+            counts = np.empty(0, dtype=np.int64)
+            first = 0
+        else:
+            first, last = buckets[nonzero].min(), buckets[nonzero].max()
+            within = (buckets >= first) & (buckets <= last)
+            counts = np.bincount(buckets[within] - first, weights=completed[within], minlength=last - first + 1).astype(np.int64)
+
+        labels = self._bucket_start(target, first + np.arange(len(counts)))
+        if target == 'W':
+            labels += 6 * DAY  # labelled by the Sunday, as with resample('W')
+
+        index = pd.DatetimeIndex(labels, freq=self.frequencies[target], name='completed_timestamp')
+        return pd.DataFrame({'count': counts if (counts != 0).all() else counts.astype(np.float64)}, index=index)
+
+    def _counts(self, resolution, groups):
+        if resolution not in self.counts:
+            raise ValueError("The flow cube does not have counts by %s" % self.frequencies.get(resolution, resolution))
+
+        counts = self.counts[resolution]
+        if groups is None:
+            return counts.sum(axis=2)
+
+        indexes = []
+        for group in groups:
+            try:
+                indexes.append(self.groups.index(group))
+            except ValueError:
+                raise ValueError("There is no group %s in the flow cube" % (group,))
+
+        return counts[:, :, indexes].sum(axis=2)
+
+    def _bucket(self, resolution, times):
+        if resolution == 'W':
+            return (times // DAY + 3) // 7  # the epoch was a Thursday
+        return times // self.bucket_sizes[resolution]
+
+    def _bucket_start(self, resolution, buckets):
+        if resolution == 'W':
+            return (buckets * 7 - 3) * DAY
+        return buckets * self.bucket_sizes[resolution]
+
+class CycleDataGroups(object):
+    """The rows of cycle data grouped by the value in the column
+    `group_by` (e.g. the query attribute), with the values listed in
+    `groups` as for `FlowCube`. The cycle time percentiles and histograms
+    for every group are worked out together, sorting or binning the cycle
+    times once, rather than filtering the cycle data for each group and
+    starting again.
+    """
+
+    def __init__(self, cycle_data, group_by):
+        self.cycle_data = cycle_data
+        self.group_by = group_by
+
+        self.codes, self.groups = _group_codes(cycle_data, group_by)
+
+        order = np.argsort(self.codes, kind='mergesort')
+        bounds = np.searchsorted(self.codes[order], np.arange(len(self.groups) + 1))
+        self.positions = [order[bounds[idx]:bounds[idx + 1]] for idx in range(len(self.groups))]
+
+    def __len__(self):
+        return len(self.groups)
+
+    def frame(self, group):
+        """Return the rows of the cycle data for `group`, in their original
+        order.
+        """
+        return self.cycle_data.take(self.positions[self._index(group)])
+
+    def percentiles(self, percentiles=(0.3, 0.5, 0.7, 0.85, 0.95,)):
+        """Return a dict with the same Series as
+        `CycleTimeQueries.percentiles()` for the cycle data of each group.
+        """
+
+        cycle_times = self.cycle_data['cycle_time'].values.view(np.int64)
+        known = cycle_times != NaT
+        codes, cycle_times = self.codes[known], cycle_times[known]
+
+        # Sorted by group, then cycle time
+        order = np.lexsort((cycle_times, codes,))
+        codes, cycle_times = codes[order], cycle_times[order]
+
+        starts = np.searchsorted(codes, np.arange(len(self.groups)))
+        counts = np.bincount(codes, minlength=max(len(self.groups), 1))[:len(self.groups)]
+
+        # A row for each group, a column for each percentile
+        padded = np.append(cycle_times, 0)  # for groups with no cycle times
+        values = interpolate(lambda ranks: padded[starts[:, np.newaxis] + ranks], counts[:, np.newaxis], percentiles)
+        values = np.where(counts[:, np.newaxis] > 0, values, np.nan)
+
+        return dict(
+            (group, pd.Series(pd.to_timedelta(values[idx]), index=percentiles, name='cycle_time'),)
+            for idx, group in enumerate(self.groups)
+        )
+
+    def histograms(self, bins=10):
+        """Return a dict with the same Series as
+        `CycleTimeQueries.histogram()` for the cycle data of each group.
+        """
+
+        days = np.asarray(self.cycle_data['cycle_time'].astype('timedelta64[D]').values, dtype=np.float64)
+        known = ~np.isnan(days)
+        codes, days = self.codes[known], days[known]
+
+        # The range of each group, as for `numpy.histogram()`
+        counts = np.bincount(codes, minlength=max(len(self.groups), 1))[:len(self.groups)]
+        low, high = np.zeros(len(self.groups)), np.ones(len(self.groups))
+        if len(days):
+            order = np.lexsort((days, codes,))
+            present = counts > 0
+            starts = np.searchsorted(codes[order], np.arange(len(self.groups)))
+            low[present] = days[order][starts[present]]
+            high[present] = days[order][starts[present] + counts[present] - 1]
+
+        same = low == high
+        low[same] -= 0.5
+        high[same] += 0.5
+
+        edges = np.array([np.linspace(low[idx], high[idx], bins + 1, endpoint=True) for idx in range(len(self.groups))]).reshape(len(self.groups), bins + 1)
+
+        # The bin of each value, as `numpy.histogram()` works it out, with
+        # the last bin including the right edge
+        indices = ((days - low[codes]) * (bins / (high - low))[codes]).astype(np.int64)
+        indices[indices == bins] -= 1
+        indices[days < edges[codes, indices]] -= 1
+        indices[(days >= edges[codes, indices + 1]) & (indices != bins - 1)] += 1
+
+        values = np.bincount(codes * bins + indices, minlength=max(len(self.groups) * bins, 1))[:len(self.groups) * bins].reshape(len(self.groups), bins)
+
+        return dict(
+            (group, pd.Series(values[idx], name="Items", index=[
+                "%.01f to %.01f" % (edges[idx, i - 1], edges[idx, i],) for i in range(1, bins + 1)
+            ]),)
+            for idx, group in enumerate(self.groups)
+        )
+
+    def _index(self, group):
+        try:
+            return self.groups.index(group)
+        except ValueError:
+            raise ValueError("There is no group %s in the cycle data" % (group,))
+
 class CycleTimeQueries(QueryManager):
     """Analysis for cycle time data, producing cumulative flow diagrams,
     scatter plots and histograms.
@@ -19,6 +486,9 @@ class CycleTimeQueries(QueryManager):
     """
 
     settings = dict(
+        query_concurrency=1,
+        processes=1,
+        compact=False,
         cycle=[  # flow steps, types, and mapped JIRA statuses
             {
                 "name": 'todo',
@@ -64,6 +534,10 @@ class CycleTimeQueries(QueryManager):
 
         super(CycleTimeQueries, self).__init__(jira, **settings)
 
+        # Indexes of the `accepted` and `complete` steps in the cycle
+        self._accepted_steps = [idx for idx, s in enumerate(self.settings['cycle']) if s['type'] == StatusTypes.accepted]
+        self._completed_steps = [idx for idx, s in enumerate(self.settings['cycle']) if s['type'] == StatusTypes.complete]
+
     def cycle_data(self, verbose=False):
         """Build a numerically indexed data frame with the following 'fixed'
         columns: `key`, 'url', 'issue_type', `summary`, `status`, and
@@ -75,7 +549,19 @@ class CycleTimeQueries(QueryManager):
 
         If 'query_attribute' is set in `settings`, a column with this name
         will be added, and populated with the `value` key, if any, from each
-        criteria block under `queries` in settings.
+        criteria block under `queries` in settings. Issues are fetched with
+        `criteria_records()`, and rows are in the order of the criteria
+        blocks.
+
+        If the `compact` setting is set, `issue_type`, `status`,
+        `resolution`, the query attribute and the `fields` columns are
+        categoricals, `summary` is not encoded as UTF-8, and there is no
+        `url` column (use `issue_url()` to get the URL for a key). This uses
+        a lot less memory for large numbers of issues.
+
+        If the `processes` setting is greater than 1, the issues are split
+        into shards and turned into rows by that many worker processes. The
+        result (and any warnings printed if `verbose` is set) is the same.
 
         In addition, `cycle_time` will be set to the time delta between the
         first `accepted`-type column and the first `complete` column, or None.
@@ -90,149 +576,443 @@ class CycleTimeQueries(QueryManager):
         stamps in the cycle are erased.
         """
 
+        criteria_records = self.criteria_records(verbose=verbose)
+
+        rows = [(criteria.get('value', None), record,) for criteria, records in criteria_records for record in records]
+
+        server = self.jira._options['server']
+        processes = min(self.settings['processes'] or 1, len(rows))
+        if processes > 1:
+            builder = self._cycle_data_builder(len(rows))
+
+            # Each process is given all the rows when it starts (which
+            # costs nothing where processes are forked), and then asked
+            # to process shards of up to a few hundred rows, in order.
+            # Warnings are collected and printed in order afterwards.
+            shard_size = max(1, min(500, -(-len(rows) // (processes * 4))))
+            shards = [(idx, idx + shard_size, server, verbose,) for idx in range(0, len(rows), shard_size)]
+
+            pool = multiprocessing.Pool(processes, _init_cycle_data_worker, (self, rows,))
+            try:
+                for partial, messages in pool.imap(_cycle_data_shard, shards):
+                    for message in messages:
+                        print message
+                    builder.extend(partial)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            builder = self._cycle_data_shard(rows, server, verbose=verbose)
+
+        if verbose:
+            self._print_fetch_summary()
+
+        cycle_data = builder.frame(columns=self._cycle_data_columns())
+
+        if verbose:
+            print "Cycle data for", len(cycle_data), "issues uses", cycle_data.memory_usage(index=True, deep=True).sum(), "bytes of memory"
+
+        return cycle_data
+
+    def cycle_data_chunks(self, verbose=False):
+        """Yield the rows of `cycle_data()` as a sequence of data frames, one
+        for each page of search results (see `criteria_record_pages()`), as
+        the pages arrive. The raw JSON and records for each page are
+        discarded once its rows are built, so memory use is bounded by the
+        `page_size` setting rather than the number of issues.
+
+        Chunks are numbered on from the previous one, so concatenating them
+        gives the same rows as `cycle_data()`, in the same order. At least
+        one (possibly empty) chunk is yielded. In `compact` mode, there are
+        no categorical columns, since the categories would differ from one
+        chunk to the next. The `processes` setting is ignored.
+        """
+
+        server = self.jira._options['server']
+        columns = self._cycle_data_columns()
+        count = 0
+
+        for criteria, records in self.criteria_record_pages(verbose=verbose):
+            builder = self._cycle_data_shard([(criteria.get('value', None), record,) for record in records], server, verbose=verbose)
+            del records
+
+            chunk = builder.frame(columns, categorical=False)
+            chunk.index = pd.RangeIndex(count, count + len(chunk))
+            count += len(chunk)
+
+            yield chunk
+
+        if count == 0:
+            yield self._cycle_data_builder(0).frame(columns, categorical=False)
+
+        if verbose:
+            self._print_fetch_summary()
+            print "Cycle data for", count, "issues built in chunks of up to", self.settings['page_size'], "issues"
+
+    def _print_fetch_summary(self):
+        queries = self.settings['queries']
+        savings = self.projection_savings(queries[0] if queries else {})
+
+        print "Requests to JIRA:", self.scheduler.summary()
+        print "Fetched", self.stats['search_bytes'], "bytes of issue data from JIRA, requesting only", \
+            len(self.search_fields()), "of", len(set(f['id'] for f in self.field_metadata) | set(self.search_fields())), "fields"
+
+        if savings is None:
+            print "Could not fetch a sample of issues with all fields to estimate the bytes saved"
+        else:
+            print "Requesting only these fields saved approximately", savings, "bytes"
+
+    def _cycle_data_columns(self):
+        return (
+            ['key'] +
+            ([] if self.settings['compact'] else ['url']) +
+            ['issue_type', 'summary', 'status', 'resolution'] +
+            sorted(self.fields.keys()) +
+            ([self.settings['query_attribute']] if self.settings['query_attribute'] else []) +
+            ['cycle_time', 'completed_timestamp'] +
+            [s['name'] for s in self.settings['cycle']]
+        )
+
+    def issue_url(self, key):
+        """Return the URL of the issue with the given key, as in the `url`
+        column of `cycle_data()`.
+        """
+        return "%s/browse/%s" % (self.jira._options['server'], key,)
+
+    def _cycle_data_builder(self, size):
+        return CycleDataBuilder(
+            size=size,
+            cycle_names=[s['name'] for s in self.settings['cycle']],
+            field_names=self.fields.keys(),
+            query_attribute=self.settings['query_attribute'],
+            compact=self.settings['compact'],
+        )
+
+    def _cycle_data_shard(self, rows, server, verbose=False, messages=None):
+        """Return a `CycleDataBuilder` with the rows of `cycle_data()` for
+        `rows`, a list of `(query_value, record)` tuples, from the JIRA
+        instance at `server`. Warnings are appended to the list `messages`,
+        if given, instead of printed.
+        """
+
+        builder = self._cycle_data_builder(len(rows))
+
+        for query_value, record in rows:
+            timestamps = self._cycle_timestamps(record, verbose=verbose, messages=messages)
+            builder.append(record, "%s/browse/%s" % (server, record.key,), query_value, timestamps, *self._cycle_time(timestamps))
+
+        return builder
+
+    def issue_cycle_data(self, issue, criteria={}, verbose=False):
+        """Return a dict of the values for one row of `cycle_data()`, for
+        the given `issue` (a `jira.resources.Issue` or an `IssueRecord`)
+        found by the given `criteria` block.
+        """
+
+        if not isinstance(issue, IssueRecord):
+            issue = self.issue_record(issue)
+
         cycle_names = [s['name'] for s in self.settings['cycle']]
-        accepted_steps = set(s['name'] for s in self.settings['cycle'] if s['type'] == StatusTypes.accepted)
-        completed_steps = set(s['name'] for s in self.settings['cycle'] if s['type'] == StatusTypes.complete)
-
-        series = {
-            'key': {'data': [], 'dtype': 'string'},
-            'url': {'data': [], 'dtype': 'string'},
-            'issue_type': {'data': [], 'dtype': 'string'},
-            'summary': {'data': [], 'dtype': 'string'},
-            'status': {'data': [], 'dtype': 'string'},
-            'resolution': {'data': [], 'dtype': 'string'},
-            'cycle_time': {'data': [], 'dtype': 'timedelta64[ns]'},
-            'completed_timestamp': {'data': [], 'dtype': 'datetime64[ns]'}
-        }
 
-        for cycle_name in cycle_names:
-            series[cycle_name] = {'data': [], 'dtype': 'datetime64[ns]'}
+        item = {
+            'key': issue.key,
+            'url': "%s/browse/%s" % (self.jira._options['server'], issue.key,),
+            'issue_type': issue.issue_type,
+            'summary': issue.summary.encode('utf-8'),
+            'status': issue.status,
+            'resolution': issue.resolution,
+            'cycle_time': None,
+            'completed_timestamp': None
+        }
 
         for name in self.fields.keys():
-            series[name] = {'data': [], 'dtype': 'object'}
+            item[name] = issue.values[name]
 
         if self.settings['query_attribute']:
-            series[self.settings['query_attribute']] = {'data': [], 'dtype': 'string'}
-
-        for criteria in self.settings['queries']:
-            for issue in self.find_issues(criteria, order='updatedDate DESC', verbose=verbose):
-
-                item = {
-                    'key': issue.key,
-                    'url': "%s/browse/%s" % (self.jira._options['server'], issue.key,),
-                    'issue_type': issue.fields.issuetype.name,
-                    'summary': issue.fields.summary.encode('utf-8'),
-                    'status': issue.fields.status.name,
-                    'resolution': issue.fields.resolution.name if issue.fields.resolution else None,
-                    'cycle_time': None,
-                    'completed_timestamp': None
-                }
-
-                for name, field_name in self.fields.items():
-                    item[name] = self.resolve_field_value(issue, name, field_name)
-
-                if self.settings['query_attribute']:
-                    item[self.settings['query_attribute']] = criteria.get('value', None)
-
-                for cycle_name in cycle_names:
-                    item[cycle_name] = None
-
-                # Record date of status changes
-                for snapshot in self.iter_changes(issue, False):
-                    snapshot_cycle_step = self.settings['cycle_lookup'].get(snapshot.status.lower(), None)
-                    if snapshot_cycle_step is None:
-                        if verbose:
-                            print issue.key, "transitioned to unknown JIRA status", snapshot.status
-                        continue
-
-                    snapshot_cycle_step_name = snapshot_cycle_step['name']
-
-                    # Keep the first time we entered a step
-                    if item[snapshot_cycle_step_name] is None:
-                        item[snapshot_cycle_step_name] = snapshot.date
-
-                    # Wipe any subsequent dates, in case this was a move backwards
-                    found_cycle_name = False
-                    for cycle_name in cycle_names:
-                        if not found_cycle_name and cycle_name == snapshot_cycle_step_name:
-                            found_cycle_name = True
-                            continue
-                        elif found_cycle_name and item[cycle_name] is not None:
-                            if verbose:
-                                print issue.key, "moved backwards to", snapshot_cycle_step_name, "wiping date for subsequent step", cycle_name
-                            item[cycle_name] = None
-
-                # Wipe timestamps if items have moved backwards; calculate cycle time
-
-                previous_timestamp = None
-                accepted_timestamp = None
-                completed_timestamp = None
-
-                for cycle_name in cycle_names:
-                    if item[cycle_name] is not None:
-                        previous_timestamp = item[cycle_name]
-
-                        if accepted_timestamp is None and previous_timestamp is not None and cycle_name in accepted_steps:
-                            accepted_timestamp = previous_timestamp
-                        if completed_timestamp is None and previous_timestamp is not None and cycle_name in completed_steps:
-                            completed_timestamp = previous_timestamp
-
-                if accepted_timestamp is not None and completed_timestamp is not None:
-                    item['cycle_time'] = completed_timestamp - accepted_timestamp
-                    item['completed_timestamp'] = completed_timestamp
-
-                for k, v in item.items():
-                    series[k]['data'].append(v)
+            item[self.settings['query_attribute']] = criteria.get('value', None)
 
-        data = {}
-        for k, v in series.items():
-            data[k] = pd.Series(v['data'], dtype=v['dtype'])
+        timestamps = self._cycle_timestamps(issue, verbose=verbose)
+        for idx, cycle_name in enumerate(cycle_names):
+            item[cycle_name] = timestamps[idx]
+
+        cycle_time, completed_timestamp = self._cycle_time(timestamps)
+        if cycle_time is not None:
+            item['cycle_time'] = cycle_time
+            item['completed_timestamp'] = completed_timestamp
+
+        return item
+
+    def _cycle_timestamps(self, issue, verbose=False, messages=None):
+        """Return a list with the date/time the `IssueRecord` `issue` first
+        entered each step in the cycle, or `None`, with the dates for later
+        steps wiped if it moved backwards. If `verbose` is set, warnings are
+        printed, or appended to the list `messages` if given.
+        """
+
+        def warn(*args):
+            if messages is None:
+                print u' '.join(unicode(arg) for arg in args)
+            else:
+                messages.append(u' '.join(unicode(arg) for arg in args))
+
+        cycle_lookup = self.settings['cycle_lookup']
+        cycle_names = [s['name'] for s in self.settings['cycle']]
+
+        # `furthest` is the index of the last step with a date, so that we
+        # only need to wipe dates when an item moves backwards.
+        timestamps = [None] * len(cycle_names)
+        furthest = -1
+
+        for change, date, status, resolution, is_resolved in self._iter_change_events(issue, False):
+            cycle_step = cycle_lookup.get(status.lower(), None)
+            if cycle_step is None:
+                if verbose:
+                    warn(issue.key, "transitioned to unknown JIRA status", status)
+                continue
+
+            idx = cycle_step['index']
+
+            # Keep the first time we entered a step
+            if timestamps[idx] is None:
+                timestamps[idx] = date
+
+            # Wipe any subsequent dates, in case this was a move backwards
+            if furthest > idx:
+                if verbose:
+                    for subsequent in range(idx + 1, furthest + 1):
+                        if timestamps[subsequent] is not None:
+                            warn(issue.key, "moved backwards to", cycle_names[idx], "wiping date for subsequent step", cycle_names[subsequent])
+                timestamps[idx + 1:] = [None] * (len(cycle_names) - idx - 1)
+
+            furthest = idx
+
+        return timestamps
+
+    def _cycle_time(self, timestamps):
+        """Return the cycle time (from the first `accepted` step to the
+        first `complete` step) and completion date for the `timestamps`
+        returned by `_cycle_timestamps()`, or `(None, None)`.
+        """
+
+        accepted_timestamp = next((timestamps[idx] for idx in self._accepted_steps if timestamps[idx] is not None), None)
+        completed_timestamp = next((timestamps[idx] for idx in self._completed_steps if timestamps[idx] is not None), None)
+
+        if accepted_timestamp is None or completed_timestamp is None:
+            return None, None
+
+        return completed_timestamp - accepted_timestamp, completed_timestamp
+
+    def time_in_status(self, active_steps=None, now=None, verbose=False):
+        """Return a DataFrame with the total time each issue spent in each
+        step of the cycle, counting every visit to the step. There is one
+        row for each row of `cycle_data()`, in the same order, with columns
+        `key`, the `query_attribute` (if set), one column for each step in
+        the cycle, and `flow_efficiency`.
+
+        `flow_efficiency` is the fraction of the time from when the issue
+        first entered an `accepted` step until it was completed (or `now`,
+        if not completed) that was spent in one of `active_steps`, a list of
+        step names. By default, these are all the `accepted` steps, so that
+        only time spent back in the backlog or in statuses that are not part
+        of the cycle counts as waiting. Pass the steps where work is
+        actually done (leaving out e.g. "Analysis Done") for a more useful
+        measure.
+
+        Time in an issue's current step is counted up to `now` (a datetime,
+        in UTC if it has no time zone), which defaults to the current time.
+        """
+
+        cycle_names = [s['name'] for s in self.settings['cycle']]
+        cycle_types = [s['type'] for s in self.settings['cycle']]
+
+        if active_steps is None:
+            active_steps = [name for name, step_type in zip(cycle_names, cycle_types) if step_type == StatusTypes.accepted]
+
+        rows, events = self._step_events(now, verbose)
+        issue, step, timestamp, duration = events['issue'], events['step'], events['timestamp'], events['duration']
+
+        n_rows, n_steps = len(rows), len(cycle_names)
+        known = step >= 0
+
+        def sums(positions, weights, length):
+            return np.bincount(positions, weights=weights, minlength=max(length, 1))[:length]
+
+        totals = sums(issue[known] * n_steps + step[known], duration[known], n_rows * n_steps).reshape(n_rows, n_steps)
+
+        # Per-step flags, with an extra `False` at the end for unknown (-1) steps
+        def step_flags(flags):
+            return np.array(list(flags) + [False], dtype=np.bool_)[step]
+
+        is_accepted = step_flags(step_type == StatusTypes.accepted for step_type in cycle_types)
+        is_complete = step_flags(step_type == StatusTypes.complete for step_type in cycle_types)
+        is_active = step_flags(name in active_steps for name in cycle_names)
+
+        # Events are grouped by issue, so the first accepted event for each
+        # issue is the first in `accepted_events` with that issue
+        accepted_events = np.flatnonzero(is_accepted)
+        accepted_issues, first_events = np.unique(issue[accepted_events], return_index=True)
+        first_accepted = np.empty(n_rows, dtype=np.int64)
+        first_accepted.fill(np.iinfo(np.int64).max)
+        first_accepted[accepted_issues] = timestamp[accepted_events[first_events]]
+
+        in_progress = (timestamp >= first_accepted[issue]) & ~is_complete
+        elapsed = sums(issue[in_progress], duration[in_progress], n_rows)
+        active = sums(issue[in_progress & is_active], duration[in_progress & is_active], n_rows)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            flow_efficiency = np.where(elapsed > 0, active / elapsed, np.nan)
+
+        data = self._step_event_rows(rows)
+        for idx, name in enumerate(cycle_names):
+            # Sums of float nanoseconds are exact to well under a microsecond
+            data[name] = pd.Series(totals[:, idx].round(-3).astype(np.int64).view('timedelta64[ns]'))
+        data['flow_efficiency'] = pd.Series(flow_efficiency, dtype='float64')
 
         return pd.DataFrame(data,
-            columns=['key', 'url', 'issue_type', 'summary', 'status', 'resolution'] +
-                    sorted(self.fields.keys()) +
+            columns=['key'] +
                     ([self.settings['query_attribute']] if self.settings['query_attribute'] else []) +
-                    ['cycle_time', 'completed_timestamp'] +
-                    cycle_names
+                    cycle_names +
+                    ['flow_efficiency']
         )
 
-    def cfd(self, cycle_data):
-        """Return the data to build a cumulative flow diagram: a DataFrame,
-        indexed by day, with columns containing cumulative counts for each
-        of the items in the configured cycle.
+    def status_visits(self, now=None, verbose=False):
+        """Return a DataFrame with a row for each visit of an issue to a step
+        in the cycle, with columns `key`, the `query_attribute` (if set),
+        `step`, `entered`, `exited` (NaT if the issue is still in the step)
+        and `duration`. Rows are grouped by issue, in the order of
+        `cycle_data()`, and then in the order of the visits.
 
-        In addition, a column called `cycle_time` contains the approximate
-        average cycle time of that day based on the first "accepted" status
-        and the first "complete" status.
+        Moving between JIRA statuses mapped to the same step does not start
+        a new visit. Time in statuses that are not part of the cycle is not
+        included. Time in an issue's current step is counted up to `now`, as
+        for `time_in_status()`.
         """
 
         cycle_names = [s['name'] for s in self.settings['cycle']]
 
-        # Build a dataframe of just the "date" columns
-        df = cycle_data[cycle_names]
+        rows, events = self._step_events(now, verbose)
+        issue, step, timestamp, duration, ends, is_last = \
+            events['issue'], events['step'], events['timestamp'], events['duration'], events['ends'], events['is_last']
+
+        # A visit starts with the first event of each issue, and whenever the step changes
+        is_start = np.ones(len(issue), dtype=np.bool_)
+        is_start[1:] = (issue[1:] != issue[:-1]) | (step[1:] != step[:-1])
+        starts = np.flatnonzero(is_start)
+        last_events = np.append(starts[1:] - 1, len(issue) - 1) if len(starts) > 0 else starts
+
+        visit_duration = np.add.reduceat(duration, starts) if len(starts) > 0 else duration
+        exited = ends[last_events]
+        exited[is_last[last_events]] = np.iinfo(np.int64).min  # NaT
+
+        known = step[starts] >= 0
+        starts, visit_duration, exited = starts[known], visit_duration[known], exited[known]
+
+        data = self._step_event_rows([rows[idx] for idx in issue[starts]])
+        data['step'] = pd.Series([cycle_names[idx] for idx in step[starts]], dtype='object')
+        data['entered'] = pd.Series(timestamp[starts].view('datetime64[ns]'))
+        data['exited'] = pd.Series(exited.view('datetime64[ns]'))
+        data['duration'] = pd.Series(visit_duration.view('timedelta64[ns]'))
+
+        return pd.DataFrame(data,
+            columns=['key'] +
+                    ([self.settings['query_attribute']] if self.settings['query_attribute'] else []) +
+                    ['step', 'entered', 'exited', 'duration']
+        )
+
+    def _step_events(self, now=None, verbose=False):
+        """Return a list of `(criteria, record)` tuples, one for each row of
+        `cycle_data()`, and a dict of arrays with one element for each time
+        an issue changed status (or was created): `issue` (the position of
+        the row), `step` (the index of the cycle step, or -1 if the status
+        is not part of the cycle), `timestamp`, `ends` (the time of the
+        issue's next change, or `now`), `duration` and `is_last` (whether
+        this is the issue's current status). Times are in nanoseconds.
+        """
+
+        if now is None:
+            now = datetime.datetime.now(UTC)
+        elif now.tzinfo is None:
+            now = now.replace(tzinfo=UTC)
+
+        rows = [(criteria, record,) for criteria, records in self.criteria_records(verbose=verbose) for record in records]
+        table = self.event_table([record for criteria, record in rows], include_resolution_changes=False)
 
-        # Strip out times from all dates
-        df = pd.DataFrame(
-            np.array(df.values, dtype='<M8[ns]').astype('<M8[D]').astype('<M8[ns]'),
-            columns=df.columns,
-            index=df.index
+        if verbose:
+            print "Calculating time in status for", len(rows), "issues from", len(table), "status changes"
+
+        status_steps = np.array(
+            [self.settings['cycle_lookup'].get(status.lower(), {}).get('index', -1) for status in table.statuses],
+            dtype=np.int32
         )
 
-        # Replace missing NaT values (happens if a status is skipped) with the subsequent timestamp
-        df = df.fillna(method='bfill', axis=1)
+        issue = table.issue
+        step = status_steps[table.status] if len(table) > 0 else np.array([], dtype=np.int32)
+        timestamp = table.timestamp
+
+        is_last = np.ones(len(issue), dtype=np.bool_)
+        is_last[:-1] = issue[1:] != issue[:-1]
+
+        ends = np.empty_like(timestamp)
+        ends[:-1] = timestamp[1:]
+        ends[is_last] = to_nanoseconds(now)
+
+        return rows, {
+            'issue': issue,
+            'step': step,
+            'timestamp': timestamp,
+            'ends': ends,
+            'duration': np.maximum(ends - timestamp, 0),
+            'is_last': is_last,
+        }
+
+    def _step_event_rows(self, rows):
+        data = {'key': pd.Series([record.key for criteria, record in rows], dtype='object')}
+        if self.settings['query_attribute']:
+            data[self.settings['query_attribute']] = pd.Series([criteria.get('value', None) for criteria, record in rows], dtype='object')
+        return data
+
+    def cfd(self, cycle_data):
+        """Return the data to build a cumulative flow diagram: a DataFrame,
+        indexed by day, with columns containing cumulative counts for each
+        of the items in the configured cycle. If an item skipped a step, it
+        is counted as entering it when it entered the next step. The index
+        runs daily from the first to the last date in any of the columns.
+
+        The items entering each step are counted per day (as days since the
+        epoch) with `np.bincount()`, and the counts are then accumulated.
+        """
+
+        cycle_names = [s['name'] for s in self.settings['cycle']]
+        times = _entry_times(cycle_data, cycle_names)
+        entered = times != NaT
+
+        if not entered.any():
+            return _cumulative_frame(np.zeros((0, len(cycle_names),), dtype=np.int64), 0, cycle_names)
 
-        # Count number of times each date occurs, preserving column order
-        df = pd.concat({col: df[col].value_counts() for col in df}, axis=1)[cycle_names]
+        days = times // DAY
+        first_day = days[entered].min()
+        size = days[entered].max() - first_day + 1
 
-        # Fill missing dates with 0 and run a cumulative sum
-        df = df.fillna(0).cumsum(axis=0)
+        counts = np.empty((size, len(cycle_names),), dtype=np.int64)
+        for idx in range(len(cycle_names)):
+            counts[:, idx] = np.bincount(days[entered[:, idx], idx] - first_day, minlength=size)
 
-        # Reindex to make sure we have all dates
-        start, end = df.index.min(), df.index.max()
-        df = df.reindex(pd.date_range(start, end, freq='D'), method='ffill')
+        return _cumulative_frame(counts, first_day, cycle_names)
 
-        return df
+    def flow_cube(self, cycle_data, group_by=None, resolutions=('H', 'D', 'W',)):
+        """Return a `FlowCube` for `cycle_data`, from which the CFD and
+        throughput can be taken for all items, or for each value of the
+        column `group_by`, at each of `resolutions`, without going over
+        `cycle_data` again.
+        """
+        return FlowCube([s['name'] for s in self.settings['cycle']], cycle_data, group_by=group_by, resolutions=resolutions)
 
+    def cycle_data_groups(self, cycle_data, group_by):
+        """Return `CycleDataGroups` for the rows of `cycle_data` grouped by
+        the value of the column `group_by`, which should be the
+        `query_attribute` or one of the `fields`.
+        """
+        return CycleDataGroups(cycle_data, group_by)
 
     def histogram(self, cycle_data, bins=10):
         """Return histogram data for the cycle times in `cycle_data`. Returns
@@ -283,8 +1063,105 @@ class CycleTimeQueries(QueryManager):
 
         return data
 
-    def percentiles(self, cycle_data, percentiles=(0.3, 0.5, 0.7, 0.85, 0.95,)):
+    def percentiles(self, cycle_data, percentiles=(0.3, 0.5, 0.7, 0.85, 0.95,), sketch=None):
         """Return percentiles for `cycle_time` in cycle data as a DataFrame
+
+        If `sketch` is given (see `cycle_time_sketch()`), the percentiles
+        are read from it instead of sorting the cycle times, and
+        `cycle_data` is not used. They are approximate (see
+        `QuantileSketch`), but in the same form.
         """
 
+        if sketch is not None:
+            return pd.Series(pd.to_timedelta(sketch.quantiles(percentiles)), index=percentiles, name='cycle_time')
+
         return cycle_data['cycle_time'].dropna().quantile(percentiles)
+
+    def rolling_percentiles(self, cycle_data, window='30D', quantiles=(0.5, 0.85, 0.95,)):
+        """Return a DataFrame indexed by day, from the first to the last day
+        on which an item in `cycle_data` was completed, with a column for
+        each of `quantiles` containing that quantile of the cycle times of
+        the items completed in the `window` (a period such as '30D') up to
+        the end of that day, or NaT if there were none. The quantiles are
+        the same as `Series.quantile()` would give for each window.
+
+        The cycle times in the window are kept sorted as the window moves
+        on a day at a time, inserting those of the items completed that day
+        and removing those of the items that are no longer in the window,
+        rather than sorting each window from scratch.
+        """
+
+        data = cycle_data[['completed_timestamp', 'cycle_time']].dropna()
+        window = pd.Timedelta(window).value
+
+        completed = data['completed_timestamp'].values.view(np.int64)
+        order = np.argsort(completed, kind='mergesort')
+        completed = completed[order]
+        cycle_times = data['cycle_time'].values.view(np.int64)[order].tolist()
+
+        if len(completed) == 0:
+            return pd.DataFrame(columns=list(quantiles), index=pd.DatetimeIndex([], freq='D'), dtype='timedelta64[ns]')
+
+        days = np.arange(completed[0] // DAY, completed[-1] // DAY + 1)
+        ends = (days + 1) * DAY
+
+        # Items completed up to the end of each day, and before its window
+        entered = np.searchsorted(completed, ends, side='left').tolist()
+        left = np.searchsorted(completed, ends - window, side='left').tolist()
+
+        values = np.empty((len(days), len(quantiles),), dtype=np.float64)
+        values.fill(np.nan)
+
+        current = []
+        added = removed = 0
+
+        for idx in range(len(days)):
+            for cycle_time in cycle_times[added:entered[idx]]:
+                bisect.insort(current, cycle_time)
+            added = entered[idx]
+
+            for cycle_time in cycle_times[removed:left[idx]]:
+                del current[bisect.bisect_left(current, cycle_time)]
+            removed = left[idx]
+
+            count = len(current)
+            if count == 0:
+                continue
+
+            values[idx] = interpolate(lambda ranks: np.array([current[rank] for rank in ranks]), count, quantiles)
+
+        return pd.DataFrame(
+            dict((q, pd.to_timedelta(values[:, column]),) for column, q in enumerate(quantiles)),
+            index=pd.date_range(pd.Timestamp(days[0] * DAY), periods=len(days), freq='D'),
+            columns=list(quantiles)
+        )
+
+    def cycle_time_sketch(self, cycle_data, sketch=None):
+        """Add the cycle times in `cycle_data` (in nanoseconds) to the
+        `QuantileSketch` `sketch`, or a new one, and return it. This can be
+        called for each chunk from `cycle_data_chunks()`, and sketches for
+        different cycle data can be merged, to give the percentiles of all
+        the cycle times without keeping them.
+        """
+
+        if sketch is None:
+            sketch = QuantileSketch()
+
+        cycle_times = cycle_data['cycle_time'].values.view(np.int64)
+        sketch.extend(np.where(cycle_times == NaT, np.nan, cycle_times))
+        return sketch
+
+# Worker processes for `CycleTimeQueries.cycle_data()`
+
+_worker_queries = None
+_worker_rows = None
+
+def _init_cycle_data_worker(queries, rows):
+    global _worker_queries, _worker_rows
+    _worker_queries = queries
+    _worker_rows = rows
+
+def _cycle_data_shard(args):
+    start, end, server, verbose = args
+    messages = []
+    return _worker_queries._cycle_data_shard(_worker_rows[start:end], server, verbose=verbose, messages=messages), messages
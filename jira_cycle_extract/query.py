@@ -1,7 +1,22 @@
 import itertools
+import collections
+import functools
 import datetime
+import threading
 import dateutil.parser
 import dateutil.tz
+import numpy as np
+
+from multiprocessing.pool import ThreadPool
+
+from jira.resources import Issue, Resource, cls_for_resource
+from jira.utils import json_loads
+from jira.exceptions import JIRAError
+from requests.exceptions import ConnectionError, Timeout
+
+from .cache import IssueCache, FieldCache
+from .scheduler import RequestScheduler, disable_retries
+from .recording import ReplayError
 
 def to_datetime(date):
     """Turn a date into a datetime at midnight.
@@ -14,14 +29,54 @@ def strip_time(datetime):
     """
     return to_datetime(datetime.date())
 
+UTC = dateutil.tz.tzutc()
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=UTC)
+
+_utc_offsets = {}  # e.g. '+0100' -> timedelta(hours=1)
+
+def parse_timestamp(value):
+    """Parse a timestamp in the format used by JIRA, e.g.
+    `2016-05-12T10:31:22.000+0100`, into a datetime in UTC.
+
+    This is much faster than `dateutil.parser.parse()`, which is used for
+    anything not in exactly this format.
+    """
+
+    try:
+        if len(value) == 28 and value[10] == 'T' and value[19] == '.':
+            try:
+                offset = _utc_offsets[value[23:]]
+            except KeyError:
+                sign = {'+': 1, '-': -1}[value[23]]
+                offset = _utc_offsets[value[23:]] = sign * datetime.timedelta(hours=int(value[24:26]), minutes=int(value[26:28]))
+
+            return datetime.datetime(
+                int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                int(value[11:13]), int(value[14:16]), int(value[17:19]), int(value[20:23]) * 1000,
+                UTC
+            ) - offset
+    except (KeyError, ValueError,):
+        pass
+
+    date = dateutil.parser.parse(value)
+    return date.astimezone(UTC) if date.tzinfo is not None else date
+
+def to_nanoseconds(date):
+    """Return a timezone-aware datetime as nanoseconds since the epoch.
+    """
+    delta = date - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000000 + delta.microseconds * 1000
+
 class IssueSnapshot(object):
     """A snapshot of the key fields of an issue at a point in its change history
     """
 
+    __slots__ = ('change', 'key', 'date', 'status', 'resolution', 'is_resolved',)
+
     def __init__(self, change, key, date, status, resolution, is_resolved):
         self.change = change
         self.key = key
-        self.date = date.astimezone(dateutil.tz.tzutc())
+        self.date = date if isinstance(date.tzinfo, dateutil.tz.tzutc) else date.astimezone(UTC)
         self.status = status
         self.resolution = resolution
         self.is_resolved = is_resolved
@@ -34,6 +89,228 @@ class IssueSnapshot(object):
             self.change, self.key, self.date.isoformat(), self.status, self.resolution, self.is_resolved
         )
 
+class EventTable(object):
+    """The status and resolution changes of a list of issues, as yielded by
+    `QueryManager.iter_changes()`, held in parallel NumPy arrays with one
+    element per change:
+
+    * `issue`: the position of the issue in `keys`
+    * `timestamp`: the date of the change, in nanoseconds since the epoch
+      (use `timestamp.view('datetime64[ns]')` to get UTC dates)
+    * `change`: `CREATED`, `STATUS` or `RESOLUTION`
+    * `status`: the position of the status after the change in `statuses`
+    * `resolution`: the position of the resolution after the change in
+      `resolutions`, the first of which is `None` (no resolution)
+    * `is_resolved`: whether the issue was resolved after the change
+
+    The changes for each issue are together, in the order they happened.
+    Build one with `QueryManager.event_table()`.
+    """
+
+    CREATED, STATUS, RESOLUTION = range(3)
+    change_names = [None, 'status', 'resolution']
+
+    def __init__(self, keys, statuses, resolutions, issue, timestamp, change, status, resolution, is_resolved):
+        self.keys = keys
+        self.statuses = statuses
+        self.resolutions = resolutions
+
+        self.issue = np.array(issue, dtype=np.int32)
+        self.timestamp = np.array(timestamp, dtype=np.int64)
+        self.change = np.array(change, dtype=np.int8)
+        self.status = np.array(status, dtype=np.int32)
+        self.resolution = np.array(resolution, dtype=np.int32)
+        self.is_resolved = np.array(is_resolved, dtype=np.bool_)
+
+    def __len__(self):
+        return len(self.issue)
+
+    def __repr__(self):
+        return "<EventTable issues=%d events=%d statuses=%d>" % (len(self.keys), len(self), len(self.statuses),)
+
+    def snapshot(self, idx):
+        """Return the change at position `idx` as an `IssueSnapshot`.
+        """
+        return IssueSnapshot(
+            change=self.change_names[self.change[idx]],
+            key=self.keys[self.issue[idx]],
+            date=EPOCH + datetime.timedelta(microseconds=int(self.timestamp[idx]) // 1000),
+            status=self.statuses[self.status[idx]],
+            resolution=self.resolutions[self.resolution[idx]],
+            is_resolved=bool(self.is_resolved[idx])
+        )
+
+class IssueRecord(object):
+    """The fields of an issue used to calculate cycle data, extracted from
+    either a `jira.resources.Issue` or the raw JSON for an issue.
+
+    `project` is a `(key, name, id)` tuple, if known. `values` is a dict of
+    the resolved values of the fields in the `fields` setting, keyed by name. `changes` is a list of `(created, items)` tuples
+    for each change history, where `items` is a tuple of `(field, to,
+    fromString, toString)` tuples.
+    """
+
+    __slots__ = ('key', 'project', 'issue_type', 'summary', 'status', 'resolution', 'created', 'values', 'changes',)
+
+    def __init__(self, key, project=None, issue_type=None, summary=None, status=None, resolution=None, created=None, values=None, changes=()):
+        self.key = key
+        self.project = project
+        self.issue_type = issue_type
+        self.summary = summary
+        self.status = status
+        self.resolution = resolution
+        self.created = created
+        self.values = values or {}
+        self.changes = changes
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return "<IssueRecord key=%s status=%s changes=%d>" % (self.key, self.status, len(self.changes),)
+
+# Positions in the `items` tuples of `IssueRecord.changes`
+CHANGE_FIELD, CHANGE_TO, CHANGE_FROM_STRING, CHANGE_TO_STRING = range(4)
+
+# The `jira` library turns each dict in an issue's JSON into a `Resource` (if
+# it has a `self` link) or a `PropertyHolder` class (if not). The functions
+# below work on the JSON directly, but give the same results as `getattr()`
+# and `str()` would on those objects, so that `resolve_raw_field_value()`
+# behaves exactly like `resolve_field_value()`.
+
+def _raw_getattr(value, name, default):
+    if isinstance(value, dict) and name in value:
+        return value[name]
+    return default
+
+def _raw_text(value):
+    if isinstance(value, dict):
+        if 'self' not in value:
+            return u"<class 'jira.resources.PropertyHolder'>"
+
+        for name in Resource._READABLE_IDS:
+            if name in value:
+                text = unicode(value[name])
+                if 'child' in value:
+                    text += ' - ' + _raw_text(value['child'])
+                return text
+
+        return u'<JIRA %s at %s>' % (cls_for_resource(value['self']).__name__, unicode(hex(id(value))),)
+
+    return unicode(value)
+
+# Resolving the value of a field in the `fields` setting. An extractor is
+# chosen for each field once, based on its type in the field metadata, and
+# called as `extractor(selection, field_value)`, where `selection` is the
+# `(known_values, ranks)` for the field (see `_select_value()`). The
+# extractors for particular types only take a shortcut if the value has the
+# expected shape, and otherwise fall back on the general rules, so the
+# result is always the same as `resolve_field_value()` or
+# `resolve_raw_field_value()`.
+
+_SCALAR_TYPES = (int, float, bool, str, unicode,)
+
+def _known_value_ranks(known_values):
+    """Return a dict of the position of the first occurrence of each value
+    in the list `known_values`, or `None` if they can't be dict keys.
+    """
+    ranks = {}
+    try:
+        for rank, value in enumerate(known_values):
+            ranks.setdefault(value, rank)
+    except TypeError:
+        return None
+    return ranks
+
+def _select_value(values, known_values, ranks):
+    """Return the first value in `known_values` that is in the (non-empty)
+    list `values`, or `None` if there isn't one. If `known_values` is
+    `None`, return the first of `values`. `ranks` is the result of
+    `_known_value_ranks(known_values)`.
+    """
+
+    if known_values is None:
+        return values[0]
+
+    if ranks is not None:
+        try:
+            found = [ranks[value] for value in values if value in ranks]
+        except TypeError:  # unhashable values
+            pass
+        else:
+            return known_values[min(found)] if found else None
+
+    return next((value for value in known_values if value in values), None)
+
+def _resource_field_value(selection, field_value):
+    if field_value is None:
+        return None
+
+    value = getattr(field_value, 'value', field_value)
+
+    if isinstance(value, (list, tuple)):
+        value = _select_value([getattr(v, 'name', v) for v in value], *selection) if len(value) > 0 else None
+
+    if not isinstance(value, _SCALAR_TYPES):
+        try:
+            value = str(value)
+        except TypeError:
+            pass
+
+    return value
+
+def _resource_scalar_value(selection, field_value):
+    if field_value is None or isinstance(field_value, _SCALAR_TYPES):
+        return field_value
+    return _resource_field_value(selection, field_value)
+
+def _raw_field_value(selection, field_value):
+    if field_value is None:
+        return None
+
+    value = _raw_getattr(field_value, 'value', field_value)
+
+    if isinstance(value, (list, tuple)):
+        value = _select_value([_raw_getattr(v, 'name', v) for v in value], *selection) if len(value) > 0 else None
+
+    if not isinstance(value, _SCALAR_TYPES):
+        value = str(_raw_text(value))
+
+    return value
+
+def _raw_scalar_value(selection, field_value):
+    if field_value is None or isinstance(field_value, _SCALAR_TYPES):
+        return field_value
+    return _raw_field_value(selection, field_value)
+
+def _raw_option_value(selection, field_value):
+    if isinstance(field_value, dict):
+        value = field_value.get('value')
+        if isinstance(value, _SCALAR_TYPES):
+            return value
+    return _raw_field_value(selection, field_value)
+
+def _raw_array_value(selection, field_value):
+    if isinstance(field_value, list) and len(field_value) > 0:
+        value = _select_value([v['name'] if isinstance(v, dict) and 'name' in v else v for v in field_value], *selection)
+        return value if isinstance(value, _SCALAR_TYPES) else str(_raw_text(value))
+    return _raw_field_value(selection, field_value)
+
+# Extractors by the `type` in a field's `schema`, as `(resource, raw)`
+_field_extractors = {
+    'string': (_resource_scalar_value, _raw_scalar_value,),
+    'number': (_resource_scalar_value, _raw_scalar_value,),
+    'date': (_resource_scalar_value, _raw_scalar_value,),
+    'datetime': (_resource_scalar_value, _raw_scalar_value,),
+    'option': (_resource_field_value, _raw_option_value,),
+    'option-with-child': (_resource_field_value, _raw_option_value,),
+    'array': (_resource_field_value, _raw_array_value,),
+}
+
 class QueryManager(object):
     """Manage and execute queries
     """
@@ -44,122 +321,504 @@ class QueryManager(object):
         fields={},
         known_values={},
         max_results=False,
+        concurrency=1,
+        page_size=50,
+        cache_dir=None,
+        full_refresh=False,
+        sync_overlap=datetime.timedelta(days=1),
+        field_cache_ttl=datetime.timedelta(days=1),
+        max_retries=5,
+        backend='resources',
+        combine_queries=False,
     )
 
     fields = {}  # resolved at runtime to JIRA fields
 
+    # Fields read from every issue, in addition to any in `fields`
+    issue_fields = ['summary', 'project', 'status', 'resolution', 'issuetype', 'created', 'updated']
+
     def __init__(self, jira, **kwargs):
         self.jira = jira
         settings = self.settings.copy()
         settings.update(kwargs)
 
         self.settings = settings
+        self.stats = dict(search_issues=0, search_bytes=0)
+        self._stats_lock = threading.Lock()
+        self._criteria_records = None
+
+        # Pages may be fetched in parallel for several criteria blocks at once
+        self.scheduler = RequestScheduler(
+            max_concurrency=(settings['concurrency'] or 1) * (settings.get('query_concurrency') or 1),
+            max_retries=settings['max_retries'],
+        )
+        disable_retries(jira._session)
         self.resolve_fields()
 
+    def __getstate__(self):
+        """Leave out the JIRA client, request scheduler and fetched issues
+        when pickling, e.g. to send a query manager to worker processes that
+        analyse issues fetched already. The copy can't make requests.
+        """
+        state = self.__dict__.copy()
+        state.update(jira=None, scheduler=None, _stats_lock=None, _criteria_records=None)
+        return state
+
     # Helpers
 
+    def _get_json(self, path, params=None):
+        """Fetch and decode a JIRA REST resource.
+
+        `JIRA._get_json()` builds its URL by mutating the client's shared
+        options dict, which is not safe when pages are fetched from several
+        threads at once, so we build the URL from a copy instead.
+        """
+        return json_loads(self._get(path, params))
+
+    def _get(self, path, params=None):
+        url = self.jira.JIRA_BASE_URL.format(**dict(self.jira._options, path=path))
+        return self.scheduler.call(self.jira._session.get, url, params=params)
+
+    def _search_page(self, query, start_at, max_results, expand=None, fields=None):
+        response = self._get('search', params={
+            'jql': query,
+            'startAt': start_at,
+            'maxResults': max_results,
+            'validateQuery': True,
+            'fields': ','.join(fields) if fields else None,
+            'expand': expand,
+        })
+        page = json_loads(response)
+
+        if expand == 'changelog':
+            with self._stats_lock:
+                self.stats['search_issues'] += len(page['issues'])
+                self.stats['search_bytes'] += len(response.content)
+
+        return page
+
+    def _fetch_issues(self, query, expand='changelog', fields=None, page_size=None):
+        """Return the raw JSON for all issues matching `query`, in order.
+
+        The first page is fetched on its own to find the total number of
+        results. The remaining pages are then fetched using up to
+        `concurrency` threads.
+        """
+
+        issues = []
+        for page in self._iter_issue_pages(query, expand, fields, page_size):
+            issues.extend(page)
+        return issues
+
+    def _iter_issue_pages(self, query, expand='changelog', fields=None, page_size=None, window=None):
+        """Yield the raw JSON for the issues matching `query`, one page at a
+        time, in order.
+
+        Pages after the first are fetched using up to `concurrency` threads.
+        If `window` is set, at most that many pages are fetched ahead of the
+        one being yielded, so that memory use is bounded.
+        """
+
+        limit = self.settings['max_results']
+        page_size = page_size or self.settings['page_size']
+        if limit and limit < page_size:
+            page_size = limit
+
+        first_page = self._search_page(query, 0, page_size, expand, fields)
+        issues = first_page['issues']
+
+        total = first_page['total']
+        if limit and limit < total:
+            total = limit
+
+        yield issues[:total]
+
+        if len(issues) == 0 or len(issues) >= total:
+            return
+
+        # The server may cap the page size below what we asked for
+        page_size = len(issues)
+        starts = range(page_size, total, page_size)
+        del first_page, issues
+
+        def fetch_page(start_at):
+            return self._search_page(query, start_at, min(page_size, total - start_at), expand, fields)['issues']
+
+        concurrency = min(self.settings['concurrency'] or 1, len(starts))
+        window = max(window or len(starts), concurrency)
+
+        pool = ThreadPool(concurrency) if concurrency > 1 else None
+        try:
+            for idx in range(0, len(starts), window):
+                batch = starts[idx:idx + window]
+                for page in (pool.map(fetch_page, batch) if pool is not None else itertools.imap(fetch_page, batch)):
+                    yield page
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def _fetch_changelog(self, key):
+        """Return the complete list of change histories for the issue with
+        the given key, using the paginated changelog resource if the server
+        has it, or the issue resource (which is not truncated) if not.
+        """
+
+        histories = []
+        try:
+            while True:
+                page = self._get_json('issue/%s/changelog' % key, params={
+                    'startAt': len(histories),
+                    'maxResults': 100,
+                })
+                histories.extend(page['values'])
+                if page.get('isLast', True) or len(page['values']) == 0 or len(histories) >= page['total']:
+                    break
+        except JIRAError, e:
+            if e.status_code != 404:
+                raise
+            histories = self._get_json('issue/%s' % key, params={
+                'fields': 'created',
+                'expand': 'changelog',
+            })['changelog']['histories']
+
+        return histories
+
+    def complete_changelogs(self, raw_issues, verbose=False):
+        """Replace the changelog of any issue in `raw_issues` (a list of
+        raw issue JSON) that was truncated by the search API, which returns
+        at most around 100 change histories per issue, with the complete
+        changelog. Changelogs are fetched using up to `concurrency` threads.
+        """
+
+        truncated = [
+            raw for raw in raw_issues
+            if 'changelog' in raw and raw['changelog'].get('total', 0) > len(raw['changelog']['histories'])
+        ]
+
+        if len(truncated) == 0:
+            return
+
+        if verbose:
+            print "Fetching complete changelogs for", len(truncated), "issues with long histories"
+
+        def fetch_changelog(raw):
+            return self._fetch_changelog(raw['key'])
+
+        concurrency = min(self.settings['concurrency'] or 1, len(truncated))
+        if concurrency > 1:
+            pool = ThreadPool(concurrency)
+            try:
+                changelogs = pool.map(fetch_changelog, truncated)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            changelogs = map(fetch_changelog, truncated)
+
+        for raw, histories in zip(truncated, changelogs):
+            raw['changelog'] = {
+                'startAt': 0,
+                'maxResults': len(histories),
+                'total': len(histories),
+                'histories': histories,
+            }
+
+    def search_fields(self):
+        """Return the ids of the fields to request for each issue: the
+        fields read by `cycle_data()` and `iter_changes()`, plus those
+        resolved from the `fields` setting.
+        """
+        return self.issue_fields + sorted(set(self.fields.values()) - set(self.issue_fields))
+
+    def projection_savings(self, criteria={}, sample_size=10):
+        """Estimate the number of bytes saved by only requesting
+        `search_fields()` for the issues fetched so far. A page of up to
+        `sample_size` issues matching `criteria` is fetched with all fields
+        and again with `search_fields()`, both without changelogs (which
+        are the same either way), and the difference per issue is scaled up
+        to the number of issues fetched.
+
+        Returns `None` if the sample can't be fetched, e.g. when replaying a
+        recording that doesn't include it.
+        """
+
+        if self.stats['search_issues'] == 0:
+            return 0
+
+        query = "%s ORDER BY KEY ASC" % self.build_query(criteria)
+        try:
+            full, projected = [
+                self._get('search', params={'jql': query, 'maxResults': sample_size, 'fields': fields})
+                for fields in ('*all', ','.join(self.search_fields()),)
+            ]
+        except (JIRAError, ConnectionError, Timeout, ReplayError,):
+            return None
+
+        count = len(json_loads(full)['issues'])
+        if count == 0:
+            return 0
+
+        return max(0, len(full.content) - len(projected.content)) * self.stats['search_issues'] // count
+
+    def jira_fields(self, refresh=False):
+        """Return a tuple `(fields, cached)`, where `fields` is the metadata
+        for all JIRA fields, as returned by `JIRA.fields()`, and `cached` is
+        whether it was read from disk rather than fetched. If `cache_dir` is
+        set, the metadata is cached on disk for `field_cache_ttl`. Pass
+        `refresh=True` to ignore the cache.
+        """
+
+        cache = None
+        if self.settings['cache_dir']:
+            cache = FieldCache(self.settings['cache_dir'], self.jira._options['server'], self.settings['field_cache_ttl'])
+            if not refresh:
+                fields = cache.load()
+                if fields is not None:
+                    return fields, True
+
+        fields = self.scheduler.call(self.jira.fields)
+
+        if cache is not None:
+            cache.save(fields)
+
+        return fields, False
+
     def resolve_fields(self):
-        fields = self.jira.fields()
+        """Resolve the field names in the `fields` setting to JIRA field ids.
+        If a name is not found in cached field metadata, the metadata is
+        fetched again in case the field was added since.
+        """
+
+        def build_index(fields):
+            index = {}
+            for f in fields:
+                index.setdefault(f['name'].lower(), f['id'])
+            return index
+
+        self.field_metadata, cached = self.jira_fields()
+        index = build_index(self.field_metadata)
 
+        self.fields = {}
         for name, field in self.settings['fields'].items():
+            if field.lower() not in index and cached:
+                self.field_metadata, cached = self.jira_fields(refresh=True)
+                index = build_index(self.field_metadata)
+
             try:
-                self.fields[name] = next((f['id'] for f in fields if f['name'].lower() == field.lower()))
-            except StopIteration:
+                self.fields[name] = index[field.lower()]
+            except KeyError:
                 raise Exception("JIRA field with name `%s` does not exist (did you try to use the field id instead?)" % field)
 
+        self.compile_field_extractors()
+
+    def compile_field_extractors(self):
+        """Choose a function to resolve the value of each field in `fields`,
+        for `issue_record()` and `raw_issue_record()`, based on its type in
+        `field_metadata`, and index the `known_values` for each field.
+        """
+
+        schemas = dict((f['id'], f.get('schema') or {},) for f in self.field_metadata)
+
+        self._known_value_selections = dict(
+            (name, (list(values), _known_value_ranks(values),))
+            for name, values in self.settings['known_values'].items()
+        )
+
+        self._field_extractors = []
+        self._raw_field_extractors = []
+
+        for name, field_id in self.fields.items():
+            selection = self._known_value_selections.get(name, (None, None,))
+            resource_extractor, raw_extractor = _field_extractors.get(
+                schemas.get(field_id, {}).get('type'),
+                (_resource_field_value, _raw_field_value,)
+            )
+
+            self._field_extractors.append((name, field_id, functools.partial(resource_extractor, selection),))
+            self._raw_field_extractors.append((name, field_id, functools.partial(raw_extractor, selection),))
+
     def resolve_field_value(self, issue, name, field_name):
-        field_value = getattr(issue.fields, field_name)
+        """Return the value of the field with id `field_name` of the
+        `jira.resources.Issue` `issue`, for the field called `name` in the
+        `fields` setting. Lists are reduced to the first value, or the first
+        of the `known_values` for `name` found in the list. Values that are
+        not numbers, booleans or strings are converted to strings.
+        """
+        return _resource_field_value(self._known_value_selections.get(name, (None, None,)), getattr(issue.fields, field_name))
 
-        if field_value is None:
-            return None
+    def resolve_raw_field_value(self, fields, name, field_id):
+        """Equivalent to `resolve_field_value()`, but working on the `fields`
+        dict of the raw JSON for an issue. A field that is missing from
+        `fields` is treated as empty.
+        """
+        return _raw_field_value(self._known_value_selections.get(name, (None, None,)), fields.get(field_id))
 
-        value = getattr(field_value, 'value', field_value)
+    def issue_record(self, issue, full=True):
+        """Return an `IssueRecord` for a `jira.resources.Issue`. If `full` is
+        false, only the key, status, created date and changes are set.
+        """
 
-        if isinstance(value, (list, tuple)):
-            if len(value) == 0:
-                value = None
-            else:
-                values = [getattr(v, 'name', v) for v in value]
-                if name not in self.settings['known_values']:
-                    value = values[0]
-                else:
-                    try:
-                        value = next(itertools.ifilter(lambda v: v in values, self.settings['known_values'][name]))
-                    except StopIteration:
-                        value = None
+        changes = [
+            (change.created, tuple((item.field, item.to, item.fromString, item.toString,) for item in change.items),)
+            for change in issue.changelog.histories
+        ]
 
-        if not isinstance(value, (int, float, bool, str, unicode)):
-            try:
-                value = str(value)
-            except TypeError:
-                pass
+        if not full:
+            return IssueRecord(
+                key=issue.key,
+                status=issue.fields.status.name,
+                created=issue.fields.created,
+                changes=changes
+            )
 
-        return value
+        project = getattr(issue.fields, 'project', None)
+
+        return IssueRecord(
+            key=issue.key,
+            project=(project.key, project.name, project.id,) if project else None,
+            issue_type=issue.fields.issuetype.name,
+            summary=issue.fields.summary,
+            status=issue.fields.status.name,
+            resolution=issue.fields.resolution.name if issue.fields.resolution else None,
+            created=issue.fields.created,
+            values=dict((name, extract(getattr(issue.fields, field_id)),) for name, field_id, extract in self._field_extractors),
+            changes=changes
+        )
+
+    def raw_issue_record(self, raw):
+        """Return an `IssueRecord` for the raw JSON of an issue, without
+        creating any `jira.resources` objects.
+        """
+
+        fields = raw['fields']
+        histories = raw['changelog']['histories'] if 'changelog' in raw else []
+
+        project = fields.get('project')
+
+        return IssueRecord(
+            key=raw['key'],
+            project=(project['key'], project['name'], project['id'],) if project else None,
+            issue_type=fields['issuetype']['name'],
+            summary=fields['summary'],
+            status=fields['status']['name'],
+            resolution=fields['resolution']['name'] if fields.get('resolution') else None,
+            created=fields['created'],
+            values=dict((name, extract(fields.get(field_id)),) for name, field_id, extract in self._raw_field_extractors),
+            changes=[
+                (change['created'], tuple((item['field'], item.get('to'), item.get('fromString'), item.get('toString'),) for item in change['items']),)
+                for change in histories
+            ]
+        )
 
     def iter_changes(self, issue, include_resolution_changes=True):
         """Yield an IssueSnapshot for each time the issue changed status or
-        resolution
+        resolution. `issue` may be a `jira.resources.Issue` or an
+        `IssueRecord`.
         """
 
-        is_resolved = False
+        if not isinstance(issue, IssueRecord):
+            issue = self.issue_record(issue, full=False)
 
-        # Find the first status change, if any
-        status_changes = filter(
-            lambda h: h.field == 'status',
-            itertools.chain.from_iterable([c.items for c in issue.changelog.histories])
-        )
-        last_status = status_changes[0].fromString if len(status_changes) > 0 else issue.fields.status.name
+        for change, date, status, resolution, is_resolved in self._iter_change_events(issue, include_resolution_changes):
+            yield IssueSnapshot(
+                change=EventTable.change_names[change],
+                key=issue.key,
+                date=date,
+                status=status,
+                resolution=resolution,
+                is_resolved=is_resolved
+            )
+
+    def event_table(self, issues, include_resolution_changes=True):
+        """Return an `EventTable` with the changes `iter_changes()` would
+        yield for each of `issues` (a list of `jira.resources.Issue` objects
+        or `IssueRecord`s), built in one pass without creating any
+        `IssueSnapshot` objects.
+        """
+
+        keys = []
+        statuses = {}
+        resolutions = {None: 0}
+        columns = issue_column, timestamp_column, change_column, status_column, resolution_column, is_resolved_column = [], [], [], [], [], []
+
+        for idx, issue in enumerate(issues):
+            if not isinstance(issue, IssueRecord):
+                issue = self.issue_record(issue, full=False)
+
+            keys.append(issue.key)
+
+            for change, date, status, resolution, is_resolved in self._iter_change_events(issue, include_resolution_changes):
+                issue_column.append(idx)
+                timestamp_column.append(to_nanoseconds(date))
+                change_column.append(change)
+                status_column.append(statuses.setdefault(status, len(statuses)))
+                resolution_column.append(resolutions.setdefault(resolution, len(resolutions)))
+                is_resolved_column.append(is_resolved)
+
+        def names(codes):
+            return [name for name, code in sorted(codes.items(), key=lambda c: c[1])]
+
+        return EventTable(keys, names(statuses), names(resolutions), *columns)
+
+    def _iter_change_events(self, issue, include_resolution_changes=True):
+        """Yield `(change, date, status, resolution, is_resolved)` for each
+        change `iter_changes()` yields for the `IssueRecord` `issue`, where
+        `change` is one of the `EventTable` change types.
+
+        The status the issue was created in is the `fromString` of its
+        first status change, if any, so the creation event is held back
+        (along with any resolution changes before the first status change)
+        until that is found, to avoid scanning the changes twice.
+        """
+
+        is_resolved = False
+        last_status = None
         last_resolution = None
+        created = None  # set once the first status change is found
+        pending = []  # (date, resolution, is_resolved) of earlier resolution changes
 
-        # Issue was created
-        yield IssueSnapshot(
-            change=None,
-            key=issue.key,
-            date=dateutil.parser.parse(issue.fields.created),
-            status=last_status,
-            resolution=None,
-            is_resolved=is_resolved
-        )
+        for change_created, items in issue.changes:
+            change_date = parse_timestamp(change_created)
 
-        for change in issue.changelog.histories:
-            change_date = dateutil.parser.parse(change.created)
+            for item in items:
+                if item[CHANGE_FIELD] == 'resolution':
+                    is_resolved = item[CHANGE_TO] is not None
 
-            resolutions = filter(lambda i: i.field == 'resolution', change.items)
-            is_resolved = (resolutions[-1].to is not None) if len(resolutions) > 0 else is_resolved
+            for item in items:
+                if item[CHANGE_FIELD] == 'status':
+                    if created is None:
+                        # Issue was created
+                        created = parse_timestamp(issue.created)
+                        last_status = item[CHANGE_FROM_STRING]
+                        yield EventTable.CREATED, created, last_status, None, False
+                        for event in pending:
+                            yield (EventTable.RESOLUTION, event[0], last_status,) + event[1:]
 
-            for item in change.items:
-                if item.field == 'status':
                     # Status was changed
-                    last_status = item.toString
-                    yield IssueSnapshot(
-                        change=item.field,
-                        key=issue.key,
-                        date=change_date,
-                        status=last_status,
-                        resolution=last_resolution,
-                        is_resolved=is_resolved
-                    )
-                elif item.field == 'resolution':
-                    last_resolution = item.toString
-                    if include_resolution_changes:
-                        yield IssueSnapshot(
-                            change=item.field,
-                            key=issue.key,
-                            date=change_date,
-                            status=last_status,
-                            resolution=last_resolution,
-                            is_resolved=is_resolved
-                        )
+                    last_status = item[CHANGE_TO_STRING]
+                    yield EventTable.STATUS, change_date, last_status, last_resolution, is_resolved
+                elif item[CHANGE_FIELD] == 'resolution':
+                    last_resolution = item[CHANGE_TO_STRING]
+                    if not include_resolution_changes:
+                        continue
+                    if created is None:
+                        pending.append((change_date, last_resolution, is_resolved,))
+                    else:
+                        yield EventTable.RESOLUTION, change_date, last_status, last_resolution, is_resolved
 
-    # Basic queries
-
-    def find_issues(self, criteria={}, jql=None, order='KEY ASC', verbose=False):
-        """Return a list of issues with changelog metadata.
+        if created is None:
+            # Issue never changed status
+            yield EventTable.CREATED, parse_timestamp(issue.created), issue.status, None, False
+            for event in pending:
+                yield (EventTable.RESOLUTION, event[0], issue.status,) + event[1:]
 
-        Searches for the `issue_types`, `project`, `valid_resolutions` and
-        'jql_filter' set in the passed-in `criteria` object.
+    # Basic queries
 
-        Pass a JQL string to further qualify the query results.
+    def build_query(self, criteria={}, jql=None):
+        """Return the JQL (without an `ORDER BY` clause) to search for the
+        `issue_types`, `project`, `valid_resolutions` and 'jql_filter' set in
+        the passed-in `criteria` object, further qualified by `jql` if set.
         """
 
         query = []
@@ -179,14 +838,325 @@ class QueryManager(object):
         if jql is not None:
             query.append('(%s)' % jql)
 
-        queryString = "%s ORDER BY %s" % (' AND '.join(query), order,)
+        return ' AND '.join(query)
+
+    def find_issues(self, criteria={}, jql=None, order='KEY ASC', verbose=False, fields=None):
+        """Return a list of issues with changelog metadata.
+
+        Searches for the `issue_types`, `project`, `valid_resolutions` and
+        'jql_filter' set in the passed-in `criteria` object.
+
+        Pass a JQL string to further qualify the query results.
+
+        Only the fields in `search_fields()` are fetched, unless a list of
+        field ids is passed as `fields` (use `['*all']` for all fields).
+
+        Pages of results are fetched in parallel if the `concurrency` setting
+        is greater than 1. Issues are returned in query order regardless.
+        """
+
+        return [
+            Issue(self.jira._options, self.jira._session, raw)
+            for raw in self.find_raw_issues(criteria, jql, order, verbose, fields)
+        ]
+
+    def find_raw_issues(self, criteria={}, jql=None, order='KEY ASC', verbose=False, fields=None):
+        """As `find_issues()`, but return the raw JSON for each issue.
+        """
+
+        queryString = "%s ORDER BY %s" % (self.build_query(criteria, jql), order,)
 
         if verbose:
             print "Fetching issues with query:", queryString
 
-        issues = self.jira.search_issues(queryString, expand='changelog', maxResults=self.settings['max_results'])
+        raw_issues = self._fetch_issues(queryString, expand='changelog', fields=fields or self.search_fields())
+        self.complete_changelogs(raw_issues, verbose=verbose)
 
         if verbose:
-            print "Fetched", len(issues), "issues"
+            print "Fetched", len(raw_issues), "issues"
 
-        return issues
+        return raw_issues
+
+    def find_raw_issue_pages(self, criteria={}, jql=None, order='KEY ASC', verbose=False, fields=None):
+        """As `find_raw_issues()`, but yield the raw JSON for the issues one
+        page of search results at a time, fetching at most `concurrency`
+        pages ahead, so that only a few pages are held in memory at once.
+        """
+
+        queryString = "%s ORDER BY %s" % (self.build_query(criteria, jql), order,)
+
+        if verbose:
+            print "Fetching issues with query:", queryString
+
+        count = 0
+        for raw_issues in self._iter_issue_pages(queryString, expand='changelog', fields=fields or self.search_fields(),
+                                                  window=self.settings['concurrency'] or 1):
+            self.complete_changelogs(raw_issues, verbose=verbose)
+            count += len(raw_issues)
+            yield raw_issues
+
+        if verbose:
+            print "Fetched", count, "issues"
+
+    def find_issue_keys(self, criteria={}, jql=None, verbose=False):
+        """Return the set of keys of all issues matching `criteria` and
+        `jql`, without fetching any other fields.
+        """
+
+        queryString = "%s ORDER BY KEY ASC" % self.build_query(criteria, jql)
+
+        if verbose:
+            print "Fetching issue keys with query:", queryString
+
+        return set(raw['key'] for raw in self._fetch_issues(queryString, expand=None, fields=['key'], page_size=1000))
+
+    def sync_issues(self, criteria={}, verbose=False):
+        """Return the same issues as `find_issues()`, most recently updated
+        first, using the on-disk cache in the `cache_dir` setting (if set) to
+        avoid downloading issues that have not changed since the last run.
+
+        Only issues updated since the last sync (less the `sync_overlap`
+        safety margin, to allow for differences between our clock and the
+        time zone JIRA uses to interpret the query) are fetched in full. The
+        keys of all matching issues are then fetched to drop issues that
+        have been deleted or no longer match the criteria, e.g. because
+        they were moved to another project.
+
+        The cache is ignored (but rebuilt) if the `full_refresh` setting is
+        set, and is not used at all if `max_results` is set.
+        """
+
+        return [Issue(self.jira._options, self.jira._session, raw) for raw in self.sync_raw_issues(criteria, verbose)]
+
+    def sync_records(self, criteria={}, verbose=False):
+        """Return an `IssueRecord` for each issue returned by `sync_issues()`.
+
+        If the `backend` setting is `json`, records are built straight from
+        the raw JSON returned by JIRA. Otherwise (the default, `resources`),
+        `jira.resources.Issue` objects are built first, as `sync_issues()`
+        does.
+        """
+
+        return self.records(self.sync_raw_issues(criteria, verbose))
+
+    def records(self, raw_issues):
+        """Return an `IssueRecord` for the raw JSON of each issue in
+        `raw_issues`, using the `backend` setting as `sync_records()` does.
+        """
+
+        if self.settings['backend'] == 'json':
+            return [self.raw_issue_record(raw) for raw in raw_issues]
+
+        return [self.issue_record(Issue(self.jira._options, self.jira._session, raw)) for raw in raw_issues]
+
+    def sync_raw_issues(self, criteria={}, verbose=False):
+        """As `sync_issues()`, but return the raw JSON for each issue.
+        """
+
+        if not self.settings['cache_dir'] or self.settings['max_results']:
+            return self.find_raw_issues(criteria, order='updatedDate DESC', verbose=verbose)
+
+        cache = IssueCache(self.settings['cache_dir'], self.jira._options['server'], self.build_query(criteria), self.search_fields())
+        sync_started = datetime.datetime.utcnow()
+
+        if not self.settings['full_refresh'] and cache.load():
+            since = cache.last_sync - self.settings['sync_overlap']
+
+            if verbose:
+                print "Loaded", len(cache.issues), "cached issues last synced at", cache.last_sync.isoformat(), "UTC"
+
+            cache.merge(self.find_raw_issues(
+                criteria,
+                jql='updated >= "%s"' % since.strftime("%Y/%m/%d %H:%M"),
+                order='updatedDate DESC',
+                verbose=verbose
+            ))
+
+            keys = self.find_issue_keys(criteria, verbose=verbose)
+            removed = cache.retain(keys)
+
+            if verbose and len(removed) > 0:
+                print "Removed", len(removed), "cached issues that were deleted or no longer match the query:", ', '.join(sorted(removed))
+
+            # Issues that match now but were not updated recently, e.g. because
+            # of a change elsewhere that brought them into scope
+            missing = sorted(keys - set(cache.issues.keys()))
+            for idx in range(0, len(missing), 100):
+                batch = missing[idx:idx + 100]
+                cache.merge(self.find_raw_issues(
+                    criteria,
+                    jql='key IN (%s)' % ', '.join(batch),
+                    order='updatedDate DESC',
+                    verbose=verbose
+                ))
+        else:
+            cache.clear()
+            cache.merge(self.find_raw_issues(criteria, order='updatedDate DESC', verbose=verbose))
+
+        cache.last_sync = sync_started
+        cache.save()
+
+        if verbose:
+            print "Cached", len(cache.issues), "issues in", cache.path
+
+        return cache.ordered()
+
+    def criteria_records(self, verbose=False, refresh=False):
+        """Return a list of `(criteria, records)` tuples, with the
+        `IssueRecord`s from `sync_records()` for each criteria block in the
+        `queries` setting, in order.
+
+        If the `combine_queries` setting is set, the issues for all blocks
+        are fetched with one query and assigned to blocks afterwards (see
+        `plan_queries()`). If `query_concurrency` is greater than 1, up to
+        that many queries are run in parallel.
+
+        The result is kept, so that several analyses can be run on the same
+        issues. Pass `refresh=True` to fetch them again.
+        """
+
+        if self._criteria_records is not None and not refresh:
+            return self._criteria_records
+
+        queries = self.settings['queries']
+        plan = self.plan_queries(queries)
+
+        def run_query(query):
+            criteria, indexes = query
+            records = self.sync_records(criteria, verbose=verbose)
+            if all(self.build_query(queries[idx]) == self.build_query(criteria) for idx in indexes):
+                partitions = [records] * len(indexes)
+            else:
+                partitions = self.partition_records(records, [queries[idx] for idx in indexes], verbose=verbose)
+            return zip(indexes, partitions)
+
+        concurrency = min(self.settings.get('query_concurrency') or 1, len(plan))
+        if concurrency > 1:
+            pool = ThreadPool(concurrency)
+            try:
+                results = pool.map(run_query, plan)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = map(run_query, plan)
+
+        self._criteria_records = [
+            (queries[idx], records,)
+            for idx, records in sorted(itertools.chain.from_iterable(results), key=lambda r: r[0])
+        ]
+        return self._criteria_records
+
+    def criteria_record_pages(self, verbose=False):
+        """Yield `(criteria, records)` tuples with the `IssueRecord`s for
+        each criteria block in the `queries` setting, in order, one page of
+        search results at a time, without keeping the raw JSON or records
+        for more than a few pages in memory.
+
+        Queries are always run one block at a time, even if the
+        `combine_queries` setting is set. If the records have already been
+        fetched by `criteria_records()`, or the `cache_dir` setting is set
+        (so that the whole cache must be loaded anyway), the records for
+        each block are fetched as usual and yielded in pages of `page_size`.
+        """
+
+        page_size = self.settings['page_size']
+
+        for idx, criteria in enumerate(self.settings['queries']):
+            if self._criteria_records is not None or (self.settings['cache_dir'] and not self.settings['max_results']):
+                if self._criteria_records is not None:
+                    records = self._criteria_records[idx][1]
+                else:
+                    records = self.sync_records(criteria, verbose=verbose)
+
+                for start in range(0, max(len(records), 1), page_size):
+                    yield criteria, records[start:start + page_size]
+                continue
+
+            for raw_issues in self.find_raw_issue_pages(criteria, order='updatedDate DESC', verbose=verbose):
+                yield criteria, self.records(raw_issues)
+
+    # Combining queries
+
+    def plan_queries(self, queries):
+        """Return a list of `(criteria, indexes)` tuples, one for each query
+        to run to fetch the issues for the criteria blocks in `queries`,
+        where `indexes` are the positions in `queries` of the blocks whose
+        issues it returns.
+
+        If the `combine_queries` setting is set, all blocks are fetched with
+        a single query for the union of their criteria (see
+        `combine_criteria()`), and `partition_records()` must be used to
+        assign the issues to each block. Otherwise, or if `max_results` is
+        set (since the limit applies to each block), each block is a query
+        of its own, except that blocks with the same query (e.g. differing
+        only in their `value`) share one, and all get the same issues. They
+        would otherwise sync the same `IssueCache` file, possibly at the
+        same time.
+        """
+
+        if not self.settings['combine_queries'] or self.settings['max_results'] or len(queries) < 2:
+            plan = collections.OrderedDict()
+            for idx, criteria in enumerate(queries):
+                plan.setdefault(self.build_query(criteria), (criteria, [],))[1].append(idx)
+            return plan.values()
+
+        return [(self.combine_criteria(queries), range(len(queries)),)]
+
+    def combine_criteria(self, queries):
+        """Return a criteria object matching exactly the issues matched by
+        any of the criteria blocks in `queries`: the JQL for each block is
+        joined with `OR`.
+        """
+
+        blocks = [self.build_query(criteria) for criteria in queries]
+
+        return {
+            'value': None,
+            'project': None,
+            'issue_types': [],
+            'valid_resolutions': [],
+            'jql_filter': None if '' in blocks else ' OR '.join('(%s)' % block for block in blocks),
+        }
+
+    def criteria_matches(self, criteria, record):
+        """Return whether the `IssueRecord` `record` matches the `project`,
+        `issue_types` and `valid_resolutions` in `criteria`, compared
+        case-insensitively as JIRA does. The `jql_filter` is ignored.
+        """
+
+        if criteria.get('project'):
+            project = criteria['project'].strip('"\'').lower()
+            if record.project is None or project not in [unicode(p).lower() for p in record.project]:
+                return False
+
+        if criteria.get('issue_types'):
+            if (record.issue_type or '').lower() not in [t.lower() for t in criteria['issue_types']]:
+                return False
+
+        if criteria.get('valid_resolutions') and record.resolution is not None:
+            if record.resolution.lower() not in [r.lower() for r in criteria['valid_resolutions']]:
+                return False
+
+        return True
+
+    def partition_records(self, records, queries, verbose=False):
+        """Given the `IssueRecord`s for the combined criteria of the blocks
+        in `queries`, return a list with the records matching each block,
+        in the same order as `records`.
+
+        The project, issue types and resolutions of a block are evaluated
+        locally. A block with a `jql_filter` can't be evaluated locally, so
+        instead the keys of the issues matching it are fetched (which is
+        much cheaper than fetching the issues again).
+        """
+
+        partitions = []
+        for criteria in queries:
+            if criteria.get('jql_filter') is not None:
+                keys = self.find_issue_keys(criteria, verbose=verbose)
+                partitions.append([record for record in records if record.key in keys])
+            else:
+                partitions.append([record for record in records if self.criteria_matches(criteria, record)])
+
+        return partitions
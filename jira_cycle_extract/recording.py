@@ -0,0 +1,125 @@
+import os
+import json
+import gzip
+import threading
+import urlparse
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+from jira.exceptions import JIRAError
+from jira.resilientsession import raise_on_error
+
+class ReplayError(Exception):
+    """Thrown when a request is made that was not recorded
+    """
+
+def recording_path(directory):
+    return os.path.join(directory, 'responses.ndjson.gz')
+
+def request_key(url, params):
+    """Return a key identifying a GET request for `url` (relative to the
+    server) with query string `params`, ignoring unset parameters and the
+    difference between e.g. numbers and strings.
+    """
+    params = dict((k, unicode(v),) for k, v in (params or {}).items() if v is not None)
+    return json.dumps([url, params], sort_keys=True)
+
+def relative_url(server, url):
+    path = urlparse.urlparse(url).path
+    server_path = urlparse.urlparse(server).path.rstrip('/')
+    return path[len(server_path):] if path.startswith(server_path) else path
+
+class RecordingSession(object):
+    """Wraps the `requests` session of a JIRA client and appends each
+    response to a gzipped, newline-delimited JSON file in `directory`, as a
+    JSON object with keys `url` (relative to the server), `params`,
+    `status`, `headers` and `body` (the raw response text).
+
+    Error responses, which the JIRA client raises as `JIRAError`, are
+    recorded too, so that the code handling them can be replayed.
+
+    Any previous recording in the same directory is replaced.
+    """
+
+    def __init__(self, session, server, directory):
+        self.session = session
+        self.server = server
+        self.path = recording_path(directory)
+        self.lock = threading.Lock()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def get(self, url, params=None, **kwargs):
+        try:
+            response = self.session.get(url, params=params, **kwargs)
+        except JIRAError, e:
+            if e.response is not None:
+                self._record(url, params, e.response)
+            raise
+
+        self._record(url, params, response)
+        return response
+
+    def _record(self, url, params, response):
+        line = json.dumps({
+            'url': relative_url(self.server, url),
+            'params': dict((k, v,) for k, v in (params or {}).items() if v is not None),
+            'status': response.status_code,
+            'headers': dict(response.headers),
+            'body': response.text,
+        })
+
+        # Each write is a separate gzip member, which `gzip` reads back as
+        # one stream. This keeps the file valid if the run is interrupted.
+        with self.lock:
+            with gzip.open(self.path, 'ab') as f:
+                f.write(line.encode('utf-8') + '\n')
+
+class ReplaySession(object):
+    """Stands in for the `requests` session of a JIRA client, answering GET
+    requests from a recording made with `RecordingSession` instead of the
+    network. Recorded error responses are raised as `JIRAError`, as the
+    JIRA client would.
+    """
+
+    def __init__(self, server, directory):
+        self.server = server
+        self.path = recording_path(directory)
+        self.headers = {}
+        self.responses = {}
+
+        if not os.path.exists(self.path):
+            raise ReplayError("No recording found in %s" % directory)
+
+        with gzip.open(self.path, 'rb') as f:
+            for line in f:
+                record = json.loads(line.decode('utf-8'))
+                self.responses[request_key(record['url'], record['params'])] = (record['status'], record.get('headers', {}), record['body'],)
+
+    def get(self, url, params=None, **kwargs):
+        relative = relative_url(self.server, url)
+
+        try:
+            status, headers, body = self.responses[request_key(relative, params)]
+        except KeyError:
+            raise ReplayError("No recorded response for %s with parameters %s. Record again with the same configuration and options." % (relative, params,))
+
+        response = Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response.url = url
+        response.encoding = 'utf-8'
+        response._content = body.encode('utf-8')
+
+        raise_on_error(response, verb='GET')
+        return response
+
+    def close(self):
+        pass
@@ -0,0 +1,158 @@
+import time
+import random
+import threading
+import email.utils
+
+from requests import Session
+from requests.exceptions import ConnectionError, Timeout
+from jira.exceptions import JIRAError
+from jira.resilientsession import ResilientSession, raise_on_error
+
+def disable_retries(session):
+    """Make the `ResilientSession` of a JIRA client send each GET request
+    only once, so that a `RequestScheduler` decides whether and when to
+    retry. Otherwise the session retries server errors up to `max_retries`
+    times in a row without any delay, and sleeps for up to 10 seconds per
+    attempt after a connection error, while holding a concurrency slot.
+
+    Sessions wrapping the client's session in their `session` attribute,
+    such as `RecordingSession`, are looked through.
+    """
+
+    while not isinstance(session, ResilientSession) and hasattr(session, 'session'):
+        session = session.session
+
+    if isinstance(session, ResilientSession):
+        def get(url, **kwargs):
+            response = Session.get(session, url, **kwargs)
+            raise_on_error(response, verb='GET')
+            return response
+
+        session.get = get
+
+class RequestScheduler(object):
+    """Run requests to JIRA, limiting how many are in flight at once and
+    retrying those that fail for temporary reasons.
+
+    The concurrency limit starts at `max_concurrency` and is adjusted
+    using additive increase / multiplicative decrease: it grows by about
+    one for each round of successful requests, and halves every time the
+    server responds with HTTP 429 (Too Many Requests). After a 429, no new
+    requests are started until the time given in the `Retry-After` header
+    (or the backoff delay, if there is none) has passed.
+
+    Server errors (5xx) and connection errors are retried after a random
+    delay of up to `backoff` seconds, doubling with each attempt up to
+    `max_backoff`. A request is retried at most `max_retries` times.
+
+    Counts of requests (each attempt), retries, throttling responses and
+    the number of seconds spent waiting because of them are kept in
+    `stats`. For these to be accurate, the function called must make a
+    single attempt (see `disable_retries()`).
+    """
+
+    def __init__(self, max_concurrency=1, max_retries=5, backoff=1.0, max_backoff=60.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.resume_at = 0.0
+
+        self.condition = threading.Condition()
+        self.stats = dict(requests=0, retries=0, throttled=0, throttled_seconds=0.0)
+
+    def call(self, fn, *args, **kwargs):
+        """Call `fn(*args, **kwargs)` when the concurrency limit allows,
+        retrying as necessary, and return its result.
+        """
+
+        attempt = 0
+        while True:
+            self._acquire()
+            success = False
+            try:
+                result = fn(*args, **kwargs)
+                success = True
+            except (JIRAError, ConnectionError, Timeout,), e:
+                status = getattr(e, 'status_code', None)
+                retryable = status is None or status == 429 or status >= 500
+
+                if not retryable or attempt >= self.max_retries:
+                    raise
+            else:
+                return result
+            finally:
+                # Free the slot whatever happened, so that an unexpected
+                # error can't leave later requests waiting for it forever
+                self._release(success=success)
+
+            if status == 429:
+                self._throttle(self._retry_after(e, attempt))
+            else:
+                time.sleep(self._delay(attempt))
+
+            attempt += 1
+            with self.condition:
+                self.stats['retries'] += 1
+
+    def summary(self):
+        return "%d requests, %d retries, throttled %d times for %.1f seconds, concurrency limit now %d of %d" % (
+            self.stats['requests'], self.stats['retries'], self.stats['throttled'],
+            self.stats['throttled_seconds'], int(self.limit), self.max_concurrency,
+        )
+
+    # Helpers
+
+    def _acquire(self):
+        with self.condition:
+            while True:
+                wait = self.resume_at - time.time()
+                if wait > 0:
+                    self.condition.wait(wait)
+                elif self.in_flight >= int(self.limit):
+                    self.condition.wait()
+                else:
+                    break
+
+            self.in_flight += 1
+            self.stats['requests'] += 1
+
+    def _release(self, success=False):
+        with self.condition:
+            self.in_flight -= 1
+            if success:
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+
+    def _throttle(self, delay):
+        with self.condition:
+            self.limit = max(1.0, self.limit / 2)
+
+            now = time.time()
+            resume_at = now + delay
+            if resume_at > self.resume_at:
+                self.stats['throttled_seconds'] += resume_at - max(now, self.resume_at)
+                self.resume_at = resume_at
+
+            self.stats['throttled'] += 1
+            self.condition.notify_all()
+
+    def _delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def _retry_after(self, error, attempt):
+        response = getattr(error, 'response', None)
+        value = response.headers.get('Retry-After') if response is not None else None
+
+        if value:
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                date = email.utils.parsedate_tz(value)
+                if date is not None:
+                    return max(0.0, email.utils.mktime_tz(date) - time.time())
+
+        return self._delay(attempt)
@@ -0,0 +1,142 @@
+import math
+import random
+
+import numpy as np
+
+def interpolate(value_at, counts, qs):
+    """Return the quantiles `qs` (between 0 and 1) of `counts` sorted
+    values, the same as `pandas.Series.quantile()`, which interpolates
+    between the values ranked either side of `q * (n - 1)`.
+
+    `value_at(ranks)` must return an array of the values at an array of
+    ranks (from 0). `counts` may be an array, e.g. a column with the number
+    of values in each of several groups, to get an array with a row of
+    quantiles for each. A count of 0 is treated as 1.
+    """
+
+    qs = np.asarray(qs, dtype=np.float64)
+    last = np.maximum(np.asarray(counts) - 1, 0)
+
+    # `Series.quantile()` passes `q * 100` to `numpy.percentile()`, which
+    # divides it by 100 again: do the same, so that the result is identical
+    positions = (qs * 100 / 100.0) * last
+    below = np.floor(positions).astype(np.int64)
+    above = np.minimum(below + 1, last)
+    fraction = positions - below
+
+    return value_at(below) * (1 - fraction) + value_at(above) * fraction
+
+class QuantileSketch(object):
+    """A KLL quantile sketch: a summary of a stream of numbers, from which
+    approximate quantiles can be read at any time, using memory that grows
+    only with the logarithm of the number of values. Sketches of different
+    streams (e.g. the cycle times for different criteria blocks, or runs)
+    can be merged into a sketch of all of them.
+
+    Values are kept in levels, where each value at level `h` stands for
+    `2 ** h` of the values added. When a level grows past its capacity, it
+    is sorted and every other value (the odd or even ones, at random) is
+    moved to the next level up. The capacity of the top level is `k`, and
+    each level below has two thirds of the capacity of the one above (but
+    at least 2), so a sketch holds fewer than `3 * k` values, plus at most
+    two for each level.
+
+    The rank of the value returned for quantile `q` of `n` values is within
+    about `1.7 / k * n` of `q * n` with 99% probability (about 0.85% of `n`
+    for the default `k` of 200), for any mix of values, and including
+    sketches that have been merged. Until the first compaction (i.e. for
+    up to `k` values) the result is exact: the same as
+    `pandas.Series.quantile()`, or `numpy.percentile()` of `q * 100`.
+
+    The choices made when compacting come from a random number generator
+    seeded with `seed`, so the results for the same values are repeatable.
+    """
+
+    def __init__(self, k=200, seed=0):
+        self.k = k
+        self.count = 0
+        self.levels = [np.empty(0, dtype=np.float64)]
+        self.random = random.Random(seed)
+
+    def __len__(self):
+        return self.count
+
+    def update(self, value):
+        """Add a single value. NaN is ignored.
+        """
+        self.extend([value])
+
+    def extend(self, values):
+        """Add each value in the sequence or array `values`, ignoring NaN.
+        """
+
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+
+        # Add values a level's worth at a time, so that no level gets much
+        # bigger than its capacity before it is compacted.
+        chunk_size = max(self._capacity(0), 1)
+        for start in range(0, len(values), chunk_size):
+            chunk = values[start:start + chunk_size]
+            self.levels[0] = np.concatenate([self.levels[0], chunk])
+            self.count += len(chunk)
+            self._compress()
+
+    def merge(self, other):
+        """Add the values summarised by the sketch `other` to this one.
+        """
+
+        for height, level in enumerate(other.levels):
+            if height == len(self.levels):
+                self.levels.append(np.empty(0, dtype=np.float64))
+            self.levels[height] = np.concatenate([self.levels[height], level])
+
+        self.count += other.count
+        self._compress()
+
+    def quantile(self, q):
+        """Return the approximate quantile `q` (between 0 and 1) of the
+        values added, or NaN if there are none.
+        """
+        return self.quantiles([q])[0]
+
+    def quantiles(self, qs):
+        """Return an array of the approximate quantiles `qs` of the values
+        added (see `quantile()`).
+        """
+
+        qs = np.asarray(qs, dtype=np.float64)
+        if self.count == 0:
+            return np.repeat(np.nan, len(qs))
+
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.repeat(2 ** height, len(level)) for height, level in enumerate(self.levels)])
+
+        order = np.argsort(values, kind='mergesort')
+        values, ends = values[order], np.cumsum(weights[order])
+
+        return interpolate(lambda ranks: values[np.searchsorted(ends, ranks, side='right')], self.count, qs)
+
+    # Helpers
+
+    def _capacity(self, height):
+        depth = len(self.levels) - height - 1
+        return max(2, int(math.ceil(self.k * (2.0 / 3) ** depth)))
+
+    def _compress(self):
+        while sum(len(level) for level in self.levels) > sum(self._capacity(h) for h in range(len(self.levels))):
+            for height, level in enumerate(self.levels):
+                if len(level) >= self._capacity(height):
+                    break
+
+            if height + 1 == len(self.levels):
+                self.levels.append(np.empty(0, dtype=np.float64))
+
+            # Compact an even number of values, leaving any odd one behind,
+            # so that the total weight stays the same
+            level = np.sort(level)
+            even = len(level) - len(level) % 2
+            offset = self.random.randint(0, 1)
+
+            self.levels[height + 1] = np.concatenate([self.levels[height + 1], level[offset:even:2]])
+            self.levels[height] = level[even:]
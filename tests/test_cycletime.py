@@ -0,0 +1,44 @@
+import unittest
+import StringIO
+
+from jira_cycle_extract.cycletime import CycleDataBuilder
+from jira_cycle_extract.query import IssueRecord
+
+def to_csv(data):
+    out = StringIO.StringIO()
+    data.to_csv(out, index=False, encoding='utf-8')
+    return out.getvalue()
+
+class CompactCycleDataTests(unittest.TestCase):
+
+    def cycle_data(self, values, compact):
+        builder = CycleDataBuilder(len(values), ['Open', 'Done'], ['Points'], compact=compact)
+        for idx, value in enumerate(values):
+            record = IssueRecord('A-%d' % idx, issue_type='Story', summary=u'Summary', status='Open', values={'Points': value})
+            builder.append(record, 'https://jira.example.com/browse/A-%d' % idx, None, [None, None], None, None)
+        return builder.frame(columns=['key', 'issue_type', 'status', 'Points'])
+
+    def test_mixed_numbers(self):
+        values = [13, 1.5, None, 13, 2]
+        compact = self.cycle_data(values, compact=True)
+
+        self.assertEqual(compact['Points'].dtype.name, 'category')
+        self.assertEqual(to_csv(compact), to_csv(self.cycle_data(values, compact=False)))
+        self.assertIn('A-0,Story,Open,13\n', to_csv(compact))
+
+    def test_equal_values_of_different_types(self):
+        values = [1, 1.0, None, 1]
+        compact = self.cycle_data(values, compact=True)
+
+        self.assertEqual(compact['Points'].dtype.name, 'object')
+        self.assertEqual(to_csv(compact), to_csv(self.cycle_data(values, compact=False)))
+
+    def test_strings(self):
+        values = [u'R01', None, u'R02', u'R01']
+        compact = self.cycle_data(values, compact=True)
+
+        self.assertEqual(compact['Points'].dtype.name, 'category')
+        self.assertEqual(to_csv(compact), to_csv(self.cycle_data(values, compact=False)))
+
+if __name__ == '__main__':
+    unittest.main()
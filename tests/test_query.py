@@ -0,0 +1,179 @@
+import json
+import shutil
+import tempfile
+import unittest
+
+from requests import Response
+
+from jira_cycle_extract.config import config_to_options
+from jira_cycle_extract.query import QueryManager, IssueRecord
+from jira_cycle_extract.recording import ReplayError
+
+CONFIG = """\
+Connection:
+    Domain: https://jira.example.com
+
+Queries:
+    Combine: true
+    Criteria:
+        - Value: A
+          Project: 10000
+          Issue types: Story
+        - Value: B
+          Project: ABC
+          Valid resolutions: Fixed
+        - Value: C
+          Issue types: Bug
+          JQL: labels = c
+
+Workflow:
+    Open: Open
+    Done: Closed
+"""
+
+class FakeJIRA(object):
+
+    _options = {'server': 'https://jira.example.com'}
+    _session = None
+
+    def __init__(self, fields=()):
+        self._fields = list(fields)
+        self.calls = 0
+
+    def fields(self):
+        self.calls += 1
+        return self._fields
+
+class CombinedQueryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.queries = config_to_options(CONFIG)['settings']['queries']
+        self.query_manager = QueryManager(FakeJIRA(), queries=self.queries, combine_queries=True)
+
+    def test_numeric_project(self):
+        self.assertEqual(self.queries[0]['project'], u'10000')
+        self.assertEqual(self.query_manager.build_query(self.queries[0]), u'project = 10000 AND issueType IN ("Story")')
+
+        record = IssueRecord('A-1', project=('KEY', 'Name', '10000'), issue_type='story')
+        self.assertTrue(self.query_manager.criteria_matches(self.queries[0], record))
+        self.assertFalse(self.query_manager.criteria_matches(self.queries[1], record))
+
+    def test_combined_query_is_exact_union(self):
+        plan = self.query_manager.plan_queries(self.queries)
+        self.assertEqual(len(plan), 1)
+
+        criteria, indexes = plan[0]
+        self.assertEqual(indexes, [0, 1, 2])
+        self.assertEqual(self.query_manager.build_query(criteria), (
+            '((project = 10000 AND issueType IN ("Story")) OR '
+            '(project = ABC AND (resolution IS EMPTY OR resolution IN ("Fixed"))) OR '
+            '(issueType IN ("Bug") AND (labels = c)))'
+        ))
+
+    def test_combined_query_with_unrestricted_block(self):
+        queries = self.queries + [{'value': 'D', 'project': None, 'issue_types': [], 'valid_resolutions': [], 'jql_filter': None}]
+        criteria, indexes = self.query_manager.plan_queries(queries)[0]
+        self.assertEqual(self.query_manager.build_query(criteria), '')
+
+class DuplicateQueryTests(unittest.TestCase):
+
+    queries = [
+        {'value': 'A', 'project': u'ABC', 'issue_types': ['Story'], 'valid_resolutions': [], 'jql_filter': None},
+        {'value': 'B', 'project': u'ABC', 'issue_types': [], 'valid_resolutions': [], 'jql_filter': None},
+        {'value': 'C', 'project': u'ABC', 'issue_types': ['Story'], 'valid_resolutions': [], 'jql_filter': None},
+    ]
+
+    def test_identical_blocks_synced_once(self):
+        query_manager = QueryManager(FakeJIRA(), queries=self.queries, query_concurrency=3)
+
+        synced = []
+        def sync_records(criteria, verbose=False):
+            synced.append(query_manager.build_query(criteria))
+            return [IssueRecord('%s-%d' % (criteria['value'], len(synced)))]
+
+        query_manager.sync_records = sync_records
+        criteria_records = query_manager.criteria_records()
+
+        self.assertEqual(sorted(synced), ['project = ABC', 'project = ABC AND issueType IN ("Story")'])
+        self.assertEqual([criteria['value'] for criteria, records in criteria_records], ['A', 'B', 'C'])
+        self.assertIs(criteria_records[0][1], criteria_records[2][1])
+        self.assertIsNot(criteria_records[0][1], criteria_records[1][1])
+
+    def test_plan(self):
+        query_manager = QueryManager(FakeJIRA(), queries=self.queries)
+        self.assertEqual(query_manager.plan_queries(self.queries), [(self.queries[0], [0, 2],), (self.queries[1], [1],)])
+
+class FieldResolutionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_unknown_field_fetched_once_without_cache(self):
+        jira = FakeJIRA()
+        self.assertRaises(Exception, QueryManager, jira, fields={'Team': 'Team'})
+        self.assertEqual(jira.calls, 1)
+
+    def test_unknown_field_fetched_once_into_empty_cache(self):
+        jira = FakeJIRA()
+        self.assertRaises(Exception, QueryManager, jira, fields={'Team': 'Team'}, cache_dir=self.cache_dir)
+        self.assertEqual(jira.calls, 1)
+
+    def test_cached_fields(self):
+        QueryManager(FakeJIRA([{'id': 'customfield_1', 'name': 'Team'}]), cache_dir=self.cache_dir)
+
+        jira = FakeJIRA()
+        query_manager = QueryManager(jira, fields={'Team': 'team'}, cache_dir=self.cache_dir)
+        self.assertEqual(query_manager.fields, {'Team': 'customfield_1'})
+        self.assertEqual(jira.calls, 0)
+
+    def test_field_added_since_cached(self):
+        QueryManager(FakeJIRA(), cache_dir=self.cache_dir)
+
+        jira = FakeJIRA([{'id': 'customfield_1', 'name': 'Team'}])
+        query_manager = QueryManager(jira, fields={'Team': 'Team'}, cache_dir=self.cache_dir)
+        self.assertEqual(query_manager.fields, {'Team': 'customfield_1'})
+        self.assertEqual(jira.calls, 1)
+
+class ProjectionSavingsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.query_manager = QueryManager(FakeJIRA(), queries=[])
+        self.query_manager.stats.update(search_issues=100, search_bytes=50000)
+        self.requests = []
+
+    def fake_get(self, path, params=None):
+        self.requests.append((path, params,))
+        issues = [{'key': 'A-%d' % idx, 'fields': {'summary': 'x' * (100 if params['fields'] == '*all' else 10)}} for idx in range(4)]
+
+        response = Response()
+        response.status_code = 200
+        response._content = json.dumps({'issues': issues})
+        return response
+
+    def test_savings(self):
+        self.query_manager._get = self.fake_get
+        savings = self.query_manager.projection_savings({'project': 'ABC'}, sample_size=4)
+
+        self.assertEqual(savings, 4 * 90 * 100 // 4)
+        self.assertEqual([params['fields'] for path, params in self.requests], ['*all', ','.join(self.query_manager.search_fields())])
+        self.assertEqual(self.requests[0][1]['jql'], 'project = ABC ORDER BY KEY ASC')
+        self.assertNotIn('expand', self.requests[0][1])
+
+    def test_sample_unavailable(self):
+        def replay_get(path, params=None):
+            raise ReplayError("No recorded response")
+
+        self.query_manager._get = replay_get
+        self.assertIsNone(self.query_manager.projection_savings())
+
+    def test_nothing_fetched(self):
+        self.query_manager.stats.update(search_issues=0, search_bytes=0)
+        self.query_manager._get = self.fake_get
+        self.assertEqual(self.query_manager.projection_savings(), 0)
+        self.assertEqual(self.requests, [])
+
+if __name__ == '__main__':
+    unittest.main()
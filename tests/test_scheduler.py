@@ -0,0 +1,125 @@
+import json
+import time
+import random
+import shutil
+import tempfile
+import unittest
+
+from requests import Response
+from requests.adapters import BaseAdapter
+from requests.exceptions import ConnectionError
+from jira.exceptions import JIRAError
+from jira.resilientsession import ResilientSession
+
+from jira_cycle_extract.query import QueryManager
+from jira_cycle_extract.recording import RecordingSession
+
+class FakeAdapter(BaseAdapter):
+    """Answers every request with `responses`, in turn (repeating the last
+    one), where each is a status code or an exception to raise.
+    """
+
+    def __init__(self, *responses):
+        super(FakeAdapter, self).__init__()
+        self.responses = list(responses)
+        self.calls = 0
+
+    def send(self, request, **kwargs):
+        self.calls += 1
+        result = self.responses[min(self.calls, len(self.responses)) - 1]
+        if isinstance(result, Exception):
+            raise result
+
+        response = Response()
+        response.status_code = result
+        response.url = request.url
+        response.request = request
+        response._content = json.dumps({'errorMessages': []} if result >= 400 else {'total': 0, 'issues': []})
+        return response
+
+    def close(self):
+        pass
+
+class FakeJIRA(object):
+
+    JIRA_BASE_URL = '{server}/rest/{rest_path}/{rest_api_version}/{path}'
+
+    def __init__(self, adapter):
+        self._options = {'server': 'https://jira.example.com', 'rest_path': 'api', 'rest_api_version': '2'}
+        self._session = ResilientSession()
+        self._session.mount('https://', adapter)
+
+    def fields(self):
+        return []
+
+class SchedulerRetryTests(unittest.TestCase):
+
+    def setUp(self):
+        # Record every sleep, by the scheduler or the JIRA library, and
+        # back off for the longest delay allowed
+        self.sleeps = []
+        self.saved = time.sleep, random.uniform
+        time.sleep = self.sleeps.append
+        random.uniform = lambda low, high: high
+
+    def tearDown(self):
+        time.sleep, random.uniform = self.saved
+
+    def query_manager(self, adapter, max_retries=2):
+        return QueryManager(FakeJIRA(adapter), max_retries=max_retries)
+
+    def test_server_errors(self):
+        adapter = FakeAdapter(503)
+        query_manager = self.query_manager(adapter)
+
+        with self.assertRaises(JIRAError) as context:
+            query_manager._get('search')
+
+        self.assertEqual(context.exception.status_code, 503)
+        self.assertEqual(adapter.calls, 3)
+        self.assertEqual(self.sleeps, [1.0, 2.0])
+        self.assertEqual(query_manager.scheduler.stats['requests'], 1 + 3)  # the field list, then the search
+        self.assertEqual(query_manager.scheduler.stats['retries'], 2)
+
+    def test_recovers_from_server_errors(self):
+        adapter = FakeAdapter(502, 504, 200)
+        query_manager = self.query_manager(adapter, max_retries=5)
+
+        self.assertEqual(query_manager._get_json('search'), {'total': 0, 'issues': []})
+        self.assertEqual(adapter.calls, 3)
+        self.assertEqual(self.sleeps, [1.0, 2.0])
+        self.assertEqual(query_manager.scheduler.stats['requests'], 1 + 3)
+
+    def test_connection_errors(self):
+        adapter = FakeAdapter(ConnectionError("connection refused"))
+        query_manager = self.query_manager(adapter)
+
+        self.assertRaises(ConnectionError, query_manager._get, 'search')
+        self.assertEqual(adapter.calls, 3)
+        self.assertEqual(self.sleeps, [1.0, 2.0])
+
+    def test_client_errors_not_retried(self):
+        adapter = FakeAdapter(400)
+        query_manager = self.query_manager(adapter)
+
+        self.assertRaises(JIRAError, query_manager._get, 'search')
+        self.assertEqual(adapter.calls, 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_recording_session(self):
+        adapter = FakeAdapter(503)
+        jira_client = FakeJIRA(adapter)
+        jira_client._session = RecordingSession(jira_client._session, jira_client._options['server'], self.recording_dir())
+        query_manager = QueryManager(jira_client, max_retries=1)
+
+        self.assertRaises(JIRAError, query_manager._get, 'search')
+        self.assertEqual(adapter.calls, 2)
+        self.assertEqual(self.sleeps, [1.0])
+
+    def recording_dir(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        return directory
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from jira_cycle_extract.sketch import QuantileSketch
+
+QUANTILES = [0, 0.01, 0.1, 0.25, 0.3, 0.5, 0.7, 0.75, 0.85, 0.9, 0.95, 0.99, 1]
+
+def sketch_of(values, k=200, seed=0):
+    sketch = QuantileSketch(k=k, seed=seed)
+    sketch.extend(values)
+    return sketch
+
+class QuantileSketchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.random = np.random.RandomState(42)
+
+    def assertRankError(self, sketch, values, k):
+        # The values returned for each quantile must be ranked within the
+        # documented bound of where the quantile is in the sorted values
+        values = np.sort(values)
+        n = len(values)
+        bound = 1.7 / k * n
+        for q, value in zip(QUANTILES, sketch.quantiles(QUANTILES)):
+            low = np.searchsorted(values, value, side='left')
+            high = np.searchsorted(values, value, side='right')
+            target = q * (n - 1)
+            error = 0 if low <= target <= high else min(abs(low - target), abs(high - target))
+            self.assertLessEqual(error, bound, "quantile %s ranked %d-%d, expected %d +/- %d" % (q, low, high, target, bound))
+
+    def test_empty(self):
+        self.assertTrue(np.isnan(QuantileSketch().quantiles(QUANTILES)).all())
+
+    def test_ignores_nan(self):
+        sketch = sketch_of([1.0, np.nan, 3.0])
+        self.assertEqual(len(sketch), 2)
+        self.assertEqual(sketch.quantile(0.5), 2.0)
+
+    def test_exact_up_to_k(self):
+        for k in (8, 50, 200):
+            for n in (1, 2, 3, k // 2, k):
+                values = self.random.lognormal(2, 1, n).round(2)
+                expected = pd.Series(values).quantile(QUANTILES).values
+                self.assertTrue(np.array_equal(sketch_of(values, k=k).quantiles(QUANTILES), expected), "k=%d, n=%d" % (k, n))
+
+    def test_exact_with_repeated_values(self):
+        values = self.random.randint(0, 5, 150).astype(np.float64)
+        expected = pd.Series(values).quantile(QUANTILES).values
+        self.assertTrue(np.array_equal(sketch_of(values).quantiles(QUANTILES), expected))
+
+    def test_rank_error(self):
+        for k in (50, 200):
+            for values in (
+                self.random.lognormal(2, 1, 50000),
+                np.arange(50000, dtype=np.float64),
+                np.arange(50000, dtype=np.float64)[::-1],
+                self.random.randint(0, 30, 50000).astype(np.float64),
+            ):
+                sketch = sketch_of(values, k=k)
+                self.assertEqual(len(sketch), len(values))
+                self.assertLess(sum(len(level) for level in sketch.levels), 3 * k + 2 * len(sketch.levels))
+                self.assertRankError(sketch, values, k)
+
+    def test_merge_exact_up_to_k(self):
+        parts = [self.random.lognormal(2, 1, n).round(2) for n in (60, 1, 80, 0, 59)]
+
+        merged = QuantileSketch()
+        for part in parts:
+            merged.merge(sketch_of(part))
+
+        combined = sketch_of(np.concatenate(parts))
+        self.assertEqual(len(merged), len(combined))
+        self.assertTrue(np.array_equal(merged.quantiles(QUANTILES), combined.quantiles(QUANTILES)))
+
+    def test_merge(self):
+        k = 100
+        parts = [self.random.lognormal(2, 1, n) for n in (20000, 5, 15000, 30)] + [np.arange(10000, dtype=np.float64)]
+
+        merged = QuantileSketch(k=k)
+        for idx, part in enumerate(parts):
+            merged.merge(sketch_of(part, k=k, seed=idx))
+
+        values = np.concatenate(parts)
+        self.assertEqual(len(merged), len(values))
+        self.assertRankError(merged, values, k)
+        self.assertRankError(sketch_of(values, k=k), values, k)
+
+if __name__ == '__main__':
+    unittest.main()